@@ -27,11 +27,51 @@
 
 import rospy
 from opencog.atomspace import TruthValue
+from opencog.scheme_wrapper import scheme_eval, scheme_eval_as
 from ghost_bridge import ActionCtrl
 
 # The ROS layer.
 action_ctrl = ActionCtrl()
 
+# On a single host the face perceptions can be evaluated straight into
+# this CogServer's atomspace, instead of being sent over TCP by the
+# ghost_bridge node, which then needs ~forward_faces turned off. Only the
+# face perception pipeline runs here, the bridge still handles speech and
+# action feedback.
+face_perception = None
+if rospy.get_param("~in_process_perception", False):
+    from ghost_bridge import FacePerception, InProcessBackend, PerceptionCtrl, FACE_HANDLES_PARAM
+    from ros_people_model.msg import Faces
+
+    face_handles_param = rospy.get_param("~face_handles_param", FACE_HANDLES_PARAM)
+    face_perception = FacePerception(PerceptionCtrl(None, None, backend=InProcessBackend()),
+                                     eye_events=rospy.get_param("~eye_events", True),
+                                     pull_perceptions=rospy.get_param("~pull_perceptions", False),
+                                     face_lost_timeout=rospy.get_param("~face_lost_timeout", 10.0),
+                                     intern_face_ids=rospy.get_param("~intern_face_ids", False),
+                                     handles_cb=lambda handles: rospy.set_param(face_handles_param, handles))
+    action_ctrl.face_handles = face_perception.face_registry
+
+    def perceive_faces(msg):
+        face_perception.observe(msg.faces)
+        face_perception.perceive(msg.faces)
+
+    rospy.Subscriber("/faces", Faces, perceive_faces, queue_size=1)
+    rospy.Timer(rospy.Duration(1), lambda event: face_perception.expire())
+
+
+# This CogServer's atomspace, where perceptions.scm keeps the trace id of
+# the latest sentence, which is taken to be the one Ghost is answering.
+atomspace = scheme_eval_as("(cog-atomspace)")
+
+
+def sentence_trace_id():
+    try:
+        return int(float(scheme_eval(atomspace, "(sentence-trace)")))
+    except Exception as e:
+        rospy.logdebug("No sentence trace: {}".format(e))
+        return 0
+
 
 # Global functions, because that's what PythonEval expects.
 # Would be great if PythonEval was fixed to work smarter, not harder.
@@ -43,7 +83,7 @@ def say(text_node, fallback_id_node):
     text = text_node.name
     fallback_id = fallback_id_node.name
     rospy.logdebug("say(text='{}', fallback_id='{}')".format(text, fallback_id))
-    action_ctrl.say(text, fallback_id)
+    action_ctrl.say(text, fallback_id, sentence_trace_id())
     return TruthValue(1, 1)
 
 
@@ -58,6 +98,8 @@ def gaze_at(face_id_node, speed_node):
     speed = float(speed_node.name)
     rospy.logdebug("gaze_at(face_id={}, speed={})".format(face_id, speed))
     action_ctrl.gaze_at(face_id, speed)
+    if face_perception is not None:
+        face_perception.mark_interaction(face_id)
     return TruthValue(1, 1)
 
 
@@ -159,3 +201,52 @@ def sing():
     rospy.logdebug("sing()")
     action_ctrl.sing()
     return TruthValue(1, 1)
+
+
+# Grounded predicates that query the recent perceptions of a face, kept by
+# the action node, rather than the atomspace.
+
+
+def face_visible(face_id_node, seconds_node):
+    face_id = action_ctrl.face_handles.resolve(face_id_node.name)
+    seconds = float(seconds_node.name)
+    visible = action_ctrl.perception_store.seconds_since_seen(face_id) <= seconds
+    rospy.logdebug("face_visible(face_id={}, seconds={}): {}".format(face_id, seconds, visible))
+    return TruthValue(1, 1) if visible else TruthValue(0, 1)
+
+
+def face_emotion(face_id_node, emotion_node, window_node):
+    face_id = action_ctrl.face_handles.resolve(face_id_node.name)
+    emotion_id = emotion_node.name
+    window = float(window_node.name)
+    confidence = action_ctrl.perception_store.emotion(face_id, emotion_id, window)
+    rospy.logdebug("face_emotion(face_id={}, emotion={}, window={}): {}".format(face_id, emotion_id, window,
+                                                                                confidence))
+    if confidence is None:
+        return TruthValue(0, 0)
+    return TruthValue(confidence, 1)
+
+
+def face_dominant_emotion(face_id_node, emotion_node, window_node):
+    face_id = action_ctrl.face_handles.resolve(face_id_node.name)
+    emotion_id = emotion_node.name
+    window = float(window_node.name)
+    dominant, confidence = action_ctrl.perception_store.dominant_emotion(face_id, window)
+    rospy.logdebug("face_dominant_emotion(face_id={}, emotion={}, window={}): {}".format(face_id, emotion_id, window,
+                                                                                         dominant))
+    return TruthValue(1, 1) if dominant == emotion_id else TruthValue(0, 1)
+
+
+def face_eyes_closed(face_id_node, seconds_node):
+    face_id = action_ctrl.face_handles.resolve(face_id_node.name)
+    seconds = float(seconds_node.name)
+    closed_for = action_ctrl.perception_store.eyes_closed_for(face_id)
+    rospy.logdebug("face_eyes_closed(face_id={}, seconds={}): {}".format(face_id, seconds, closed_for))
+    return TruthValue(1, 1) if closed_for > seconds else TruthValue(0, 1)
+
+
+def action_ready(action_node):
+    action = action_node.name
+    ready = action_ctrl.is_ready(action)
+    rospy.logdebug("action_ready(action={}): {}".format(action, ready))
+    return TruthValue(1, 1) if ready else TruthValue(0, 1)
@@ -15,6 +15,13 @@
 
  (if (not (null? dfn)) (cog-delete (car dfn)) #f))
 
+(define (delete-predicate-definition STR)
+ (define dfn
+  (cog-get-link 'DefineLink 'DefinedPredicateNode
+   (DefinedPredicate STR)))
+
+ (if (not (null? dfn)) (cog-delete (car dfn)) #f))
+
 
 ; -------------------------------------------------------------
 ; Action name definitions
@@ -41,6 +48,13 @@
 
 (define sing "sing")
 
+(define face-visible "face-visible")
+(define face-emotion "face-emotion")
+(define face-dominant-emotion "face-dominant-emotion")
+(define face-eyes-closed "face-eyes-closed")
+
+(define action-ready "action-ready")
+
 ; -------------------------------------------------------------
 ; Say something.
 ;
@@ -82,10 +96,12 @@
   )))
 
 ;---------------------------------------------------------------
-; Request the robot to point its face and eyes at a specific face_id
+; Request the robot to point its face and eyes at a specific face_id, or
+; with "nearest" at the face closest to the robot
 ;
 ; Example usage:
 ;   (cog-execute! (Put (DefinedSchema "gaze-at") (List (Concept "aef7dfsd89f8dsf9dsf97dsf") (Number 0.5))))
+;   (cog-execute! (Put (DefinedSchema "gaze-at") (List (Concept "nearest") (Number 0.5))))
 ;
 
 (delete-definition gaze-at)
@@ -352,4 +368,117 @@
   )))
 
 
+; -------------------------------------------------------------
+; Perception queries. The action node keeps the last few seconds of each
+; face's perceptions, so rules can ask for what they need instead of every
+; eye state and emotion being pushed into the atomspace.
+;
+; Whether a face has been seen in the last N seconds
+;
+; Example usage:
+;   (cog-evaluate! (Put (DefinedPredicate "face-visible") (List (Concept "aef7dfsd89f8dsf9dsf97dsf") (Number 2))))
+;
+
+(delete-predicate-definition face-visible)
+(DefineLink
+ (DefinedPredicate face-visible)
+ (LambdaLink
+  (VariableList
+   (Variable "$face_id")
+   (Variable "$seconds"))
+  (EvaluationLink (GroundedPredicate "py:face_visible")
+   (ListLink
+    (Variable "$face_id")
+    (Variable "$seconds")))))
+
+
+; -------------------------------------------------------------
+; The mean confidence of one of a face's emotions over the last N seconds,
+; as the strength of the truth value
+;
+; Example usage:
+;   (cog-evaluate! (Put (DefinedPredicate "face-emotion") (List (Concept "aef7dfsd89f8dsf9dsf97dsf") (Concept "happy") (Number 1))))
+;
+
+(delete-predicate-definition face-emotion)
+(DefineLink
+ (DefinedPredicate face-emotion)
+ (LambdaLink
+  (VariableList
+   (Variable "$face_id")
+   (Variable "$emotion")
+   (Variable "$window"))
+  (EvaluationLink (GroundedPredicate "py:face_emotion")
+   (ListLink
+    (Variable "$face_id")
+    (Variable "$emotion")
+    (Variable "$window")))))
+
+
+; -------------------------------------------------------------
+; Whether an emotion has been a face's dominant emotion over the last N
+; seconds
+;
+; Example usage:
+;   (cog-evaluate! (Put (DefinedPredicate "face-dominant-emotion") (List (Concept "aef7dfsd89f8dsf9dsf97dsf") (Concept "happy") (Number 1))))
+;
+
+(delete-predicate-definition face-dominant-emotion)
+(DefineLink
+ (DefinedPredicate face-dominant-emotion)
+ (LambdaLink
+  (VariableList
+   (Variable "$face_id")
+   (Variable "$emotion")
+   (Variable "$window"))
+  (EvaluationLink (GroundedPredicate "py:face_dominant_emotion")
+   (ListLink
+    (Variable "$face_id")
+    (Variable "$emotion")
+    (Variable "$window")))))
+
+
+; -------------------------------------------------------------
+; Whether a face's eyes have been closed for more than N seconds
+;
+; Example usage:
+;   (cog-evaluate! (Put (DefinedPredicate "face-eyes-closed") (List (Concept "aef7dfsd89f8dsf9dsf97dsf") (Number 2))))
+;
+
+(delete-predicate-definition face-eyes-closed)
+(DefineLink
+ (DefinedPredicate face-eyes-closed)
+ (LambdaLink
+  (VariableList
+   (Variable "$face_id")
+   (Variable "$seconds"))
+  (EvaluationLink (GroundedPredicate "py:face_eyes_closed")
+   (ListLink
+    (Variable "$face_id")
+    (Variable "$seconds")))))
+
+
+
+; -------------------------------------------------------------
+; Whether the server or service an action needs is up. gaze-at and
+; gaze-at-cancel need the face tracker, blink-cancel and saccade-cancel
+; need blender. Until then gaze-at, blink-cancel and saccade-cancel are
+; queued, and carried out once it is up. gaze-at-cancel drops a queued
+; gaze-at.
+;
+; Example usage:
+;   (cog-evaluate! (Put (DefinedPredicate "action-ready") (List (Concept "gaze-at"))))
+;
+
+(delete-predicate-definition action-ready)
+(DefineLink
+ (DefinedPredicate action-ready)
+ (LambdaLink
+  (VariableList
+   (Variable "$action"))
+  (EvaluationLink (GroundedPredicate "py:action_ready")
+   (ListLink
+    (Variable "$action")))))
+
+
 *unspecified* ; Make the load be silent
@@ -0,0 +1,339 @@
+#! /usr/bin/env python
+#
+# benchmark.py - Throughput and latency of the perception path against a stand-in CogServer
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Drives synthetic load through the bridge into a CogServerEmulator and
+# reports messages/s, CPU per message and tail latency for each scenario:
+#
+#   perception_ctrl  PerceptionCtrl.perceive_face as fast as it can be called
+#   action_feedback  ActionFeedbackCtrl say-started/say-finished pairs
+#   faces            N faces at M fps through GhostBridge.faces_latest_cb
+#   words            bursts of words through GhostBridge.perceive_word_cb
+#
+# The emulator runs in a child process so that the CPU time measured is
+# only the bridge's. The faces and words scenarios create a GhostBridge,
+# so they need a roscore; the others don't need ROS running. Every
+# scenario imports the ghost_bridge package though, so the package's ROS
+# dependencies, e.g. rospy and the message packages, must be installed.
+#
+# With --min-rate and --max-p99 the script exits with status 1 when a
+# scenario is slower than that, so it can be used as a regression gate:
+#
+#   rosrun ghost_bridge benchmark.py --scenarios perception_ctrl,action_feedback --min-rate 2000 --max-p99 0.05
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from ghost_bridge.backends import SocketBackend
+from ghost_bridge.emulator import CogServerEmulator
+from ghost_bridge.metrics import Metrics
+
+SCENARIOS = ["perception_ctrl", "action_feedback", "faces", "words"]
+
+
+def serve_emulator(conn, options):
+    emulator = CogServerEmulator(**options).start()
+    conn.send(emulator.port)
+    while True:
+        command = conn.recv()
+        if command[0] == "wait":
+            n, timeout = command[1:]
+            ok = emulator.wait_for(n, timeout)
+            with emulator.cond:
+                received = [(e.time, e.procedure) for e in emulator.received]
+            conn.send((ok, received))
+        elif command[0] == "reset":
+            emulator.reset()
+            conn.send(True)
+        elif command[0] == "stop":
+            emulator.stop()
+            conn.send(True)
+            return
+
+
+class EmulatorProcess(object):
+    """
+        A CogServerEmulator running in a child process.
+    """
+
+    def __init__(self, **options):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_emulator, args=(child, options))
+        self.process.daemon = True
+        self.process.start()
+        self.port = self.conn.recv()
+
+    def wait_for(self, n, timeout=30.0):
+        """ Wait for n expressions to arrive
+
+        :return: (all arrived, list of (arrival time, procedure))
+        """
+
+        self.conn.send(("wait", n, timeout))
+        return self.conn.recv()
+
+    def reset(self):
+        self.conn.send(("reset",))
+        self.conn.recv()
+
+    def stop(self):
+        self.conn.send(("stop",))
+        self.conn.recv()
+        self.process.join(1.0)
+
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def result(name, messages, elapsed, cpu, latencies, complete, extra=None):
+    r = {
+        "scenario": name,
+        "messages": messages,
+        "complete": complete,
+        "rate": messages / elapsed if elapsed > 0 else 0.0,
+        "cpu_per_message_us": 1e6 * cpu / messages if messages else 0.0,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": max(latencies) if latencies else 0.0
+    }
+    if extra is not None:
+        r.update(extra)
+    return r
+
+
+def latencies_in_order(sent, received, procedure):
+    """ Match sends to arrivals by order. Only valid for lanes that never drop or reorder. """
+
+    arrivals = [t for t, name in received if name == procedure]
+    return [arrived - queued for queued, arrived in zip(sent, arrivals)]
+
+
+def run_perception_ctrl(emulator, args):
+    from ghost_bridge.perception_ctrl import PerceptionCtrl
+
+    n = args.messages
+    backend = SocketBackend("localhost", emulator.port, maxsize=n, telemetry_max_age=None, metrics=Metrics())
+    ctrl = PerceptionCtrl("localhost", emulator.port, backend=backend)
+
+    sent = []
+    cpu = cpu_time()
+    start = time.time()
+    for i in range(n):
+        sent.append(time.time())
+        ctrl.perceive_face("face{}".format(i % args.faces), 0.5, 0.1, 0.2, 0.9)
+    complete, received = emulator.wait_for(n)
+    elapsed = max(t for t, name in received) - start if received else 0.0
+    cpu = cpu_time() - cpu
+    backend.close()
+
+    return result("perception_ctrl", len(received), elapsed, cpu,
+                  latencies_in_order(sent, received, "perceive-face"), complete)
+
+
+def run_action_feedback(emulator, args):
+    from ghost_bridge.action_feedback_ctrl import ActionFeedbackCtrl
+
+    pairs = args.messages // 2
+    backend = SocketBackend("localhost", emulator.port, metrics=Metrics())
+    ctrl = ActionFeedbackCtrl("localhost", emulator.port, backend=backend)
+
+    sent = []
+    cpu = cpu_time()
+    start = time.time()
+    for i in range(pairs):
+        sent.append(time.time())
+        ctrl.say_started()
+        ctrl.say_finished()
+    complete, received = emulator.wait_for(2 * pairs)
+    elapsed = max(t for t, name in received) - start if received else 0.0
+    cpu = cpu_time() - cpu
+    backend.close()
+
+    return result("action_feedback", len(received), elapsed, cpu,
+                  latencies_in_order(sent, received, "say-started"), complete)
+
+
+bridges = []
+
+
+def make_bridge(emulator):
+    """ The GhostBridge under test, shared by the scenarios since a node can only register its services once """
+
+    import rospy
+    from ghost_bridge.ghost_bridge_ctrl import GhostBridge
+
+    if not bridges:
+        rospy.init_node("ghost_bridge_benchmark", disable_signals=True)
+        if not rospy.has_param("robot_name"):
+            rospy.set_param("robot_name", "benchmark")
+        rospy.set_param("~cogserver_port", emulator.port)
+        bridges.append(GhostBridge())
+    return bridges[0]
+
+
+def make_faces(n, frame):
+    from geometry_msgs.msg import Point
+    from ros_people_model.msg import Face, Faces
+
+    faces = []
+    for i in range(n):
+        # Values drift a little every frame so that some, but not all, perceptions change
+        drift = 0.01 * ((frame + i) % 10)
+        faces.append(Face(face_id="face{}".format(i), position=Point(1.0 + i, 0.1 * i, 0.0),
+                          certainty=0.8 + drift, eye_states=[0.9 - drift, 0.9],
+                          emotions=[0.1, 0.0, 0.0, 0.5 + drift, 0.1, 0.0, 0.3]))
+    return Faces(faces=faces)
+
+
+def run_faces(emulator, args):
+    bridge = make_bridge(emulator)
+
+    frames = int(args.duration * args.fps)
+    messages = [make_faces(args.faces, frame) for frame in range(frames)]
+
+    cpu = cpu_time()
+    start = time.time()
+    for i, msg in enumerate(messages):
+        bridge.faces_latest_cb(msg)
+        time.sleep(max(0.0, start + (i + 1) / float(args.fps) - time.time()))
+
+    # Let the forwarder and sender drain, then count what arrived
+    time.sleep(1.0)
+    complete, received = emulator.wait_for(0)
+    elapsed = time.time() - start
+    cpu = cpu_time() - cpu
+
+    summary = bridge.metrics.summaries("trace.faces.total").get("trace.faces.total", {})
+    forwarded = summary.get("count", 0)
+    r = result("faces", len(received), elapsed, cpu, [], True, {
+        "frames": frames,
+        "frames_forwarded": forwarded,
+        "cpu_per_frame_us": 1e6 * cpu / frames if frames else 0.0,
+        "latency_p50": summary.get("p50", 0.0),
+        "latency_p95": summary.get("p95", 0.0),
+        "latency_p99": summary.get("p99", 0.0),
+        "latency_max": summary.get("max", 0.0),
+        "faces_rate": bridge.faces_rate.rate
+    })
+    return r
+
+
+def run_words(emulator, args):
+    from hr_msgs.msg import ChatMessage
+
+    bridge = make_bridge(emulator)
+
+    sent = []
+    cpu = cpu_time()
+    start = time.time()
+    for burst in range(args.bursts):
+        for i in range(args.burst_size):
+            sent.append(time.time())
+            bridge.perceive_word_cb(ChatMessage(utterance="word{}".format(i)))
+        time.sleep(args.burst_interval)
+
+    # Each word is sent with a perceive-face-talking
+    n = 2 * len(sent)
+    complete, received = emulator.wait_for(n)
+    words = [t for t, name in received if name == "perceive-word"]
+    elapsed = (max(words) - start) if words else 0.0
+    cpu = cpu_time() - cpu
+
+    return result("words", len(words), elapsed, cpu, latencies_in_order(sent, received, "perceive-word"), complete)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ghost_bridge perception path against a stand-in "
+                                                 "CogServer")
+    parser.add_argument("--scenarios", default="perception_ctrl,action_feedback",
+                        help="comma separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--messages", type=int, default=10000, help="messages sent by the ctrl scenarios")
+    parser.add_argument("--faces", type=int, default=5, help="faces in each Faces message")
+    parser.add_argument("--fps", type=float, default=15.0, help="Faces messages per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds the faces scenario runs for")
+    parser.add_argument("--bursts", type=int, default=20, help="word bursts in the words scenario")
+    parser.add_argument("--burst-size", type=int, default=10, help="words in each burst")
+    parser.add_argument("--burst-interval", type=float, default=0.5, help="seconds between word bursts")
+    parser.add_argument("--latency", type=float, default=0.0, help="emulated seconds to evaluate each expression")
+    parser.add_argument("--jitter", type=float, default=0.0, help="emulated random +/- evaluation seconds")
+    parser.add_argument("--read-size", type=int, default=4096, help="most bytes the emulator reads at once")
+    parser.add_argument("--read-delay", type=float, default=0.0, help="seconds the emulator sleeps before reads")
+    parser.add_argument("--min-rate", type=float, default=None, help="fail if a scenario is slower, messages/s")
+    parser.add_argument("--max-p99", type=float, default=None, help="fail if a scenario's p99 latency is higher, s")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario '{}'".format(name))
+
+    emulator = EmulatorProcess(latency=args.latency, jitter=args.jitter, read_size=args.read_size,
+                               read_delay=args.read_delay)
+    results = []
+    try:
+        for name in scenarios:
+            emulator.reset()
+            results.append(globals()["run_" + name](emulator, args))
+    finally:
+        for bridge in bridges:
+            bridge.shutdown()
+        emulator.stop()
+
+    failures = []
+    for r in results:
+        if not r["complete"]:
+            failures.append("{}: not every message arrived".format(r["scenario"]))
+        if args.min_rate is not None and r["rate"] < args.min_rate:
+            failures.append("{}: {:.0f} messages/s < {:.0f}".format(r["scenario"], r["rate"], args.min_rate))
+        if args.max_p99 is not None and r["latency_p99"] > args.max_p99:
+            failures.append("{}: p99 {:.4f}s > {:.4f}s".format(r["scenario"], r["latency_p99"], args.max_p99))
+
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, indent=2, sort_keys=True))
+    else:
+        print("{:<16} {:>8} {:>10} {:>10} {:>9} {:>9} {:>9}".format("scenario", "messages", "msgs/s", "cpu/msg us",
+                                                                   "p50 ms", "p95 ms", "p99 ms"))
+        for r in results:
+            print("{:<16} {:>8} {:>10.0f} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                r["scenario"], r["messages"], r["rate"], r["cpu_per_message_us"], 1e3 * r["latency_p50"],
+                1e3 * r["latency_p95"], 1e3 * r["latency_p99"]))
+        for failure in failures:
+            print("FAIL " + failure)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
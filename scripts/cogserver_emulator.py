@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+#
+# cogserver_emulator.py - Run a stand-in CogServer that records what it is sent
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import argparse
+import logging
+import time
+
+from ghost_bridge.emulator import CogServerEmulator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in CogServer that counts the scheme expressions it receives")
+    parser.add_argument("--port", type=int, default=17001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to evaluate each expression")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- seconds added to the latency")
+    parser.add_argument("--read-size", type=int, default=4096, help="most bytes read from a session at once")
+    parser.add_argument("--read-delay", type=float, default=0.0, help="seconds slept before each read")
+    parser.add_argument("--refuse", type=int, default=0, help="number of connections to drop on accept")
+    parser.add_argument("--report-period", type=float, default=5.0, help="seconds between reports")
+    parser.add_argument("--verbose", action="store_true", help="also log the latest expressions received")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s %(message)s")
+    emulator = CogServerEmulator(port=args.port, latency=args.latency, jitter=args.jitter, read_size=args.read_size,
+                                 read_delay=args.read_delay, refuse=args.refuse).start()
+
+    try:
+        received = 0
+        while True:
+            time.sleep(args.report_period)
+            stats = emulator.stats()
+            rate = (stats["received"] - received) / args.report_period
+            received = stats["received"]
+            logging.info("%.1f expressions/s, %d sessions open, counts: %s", rate, stats["open_sessions"],
+                         stats["counts"])
+            if args.verbose:
+                for expression in emulator.received[-10:]:
+                    logging.debug("%s", expression.text)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
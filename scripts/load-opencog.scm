@@ -18,6 +18,7 @@
     "opencog::AFRentCollectionAgent"))
 
 (load "load-actions.scm")
+(load "perceptions.scm")
 
 (ecan-based-ghost-rules #t)
 (set-relex-server-host)
@@ -0,0 +1,142 @@
+;
+; perceptions.scm
+;
+; Perceptions sent by ghost_bridge, in addition to the ones provided by
+; (opencog ghost procedures).
+;
+
+; -------------------------------------------------------------
+; The dominant emotion of a face has changed. ghost_bridge sends this
+; when the strongest of a face's smoothed emotions changes, so rules can
+; react to a change of mood without watching every emotion confidence.
+;
+; Example usage:
+;   (perceive-dominant-emotion "aef7dfsd89f8dsf9dsf97dsf" "happy")
+;   (cog-execute! (Get (State (List (Concept "dominant-emotion") (Concept "aef7dfsd89f8dsf9dsf97dsf")) (Variable "$e"))))
+;
+
+(define (perceive-dominant-emotion FACE-ID EMOTION)
+ (StateLink
+  (ListLink
+   (ConceptNode "dominant-emotion")
+   (ConceptNode FACE-ID))
+  (ConceptNode EMOTION)))
+
+; -------------------------------------------------------------
+; A face has come into view. ghost_bridge sends this the first time it
+; sees a face, with the face's id or, when ids are interned, its short
+; handle.
+;
+; Example usage:
+;   (perceive-face-appeared "aef7dfsd89f8dsf9dsf97dsf")
+;   (cog-execute! (Get (State (List (Concept "face-present") (Concept "aef7dfsd89f8dsf9dsf97dsf")) (Variable "$p"))))
+;
+
+(define (perceive-face-appeared FACE-ID)
+ (StateLink
+  (ListLink
+   (ConceptNode "face-present")
+   (ConceptNode FACE-ID))
+  (ConceptNode "yes")))
+
+; -------------------------------------------------------------
+; A face has been out of view for longer than ghost_bridge's
+; face_lost_timeout. Every atom about the face is deleted, so the
+; atomspace doesn't grow with each person who walks past. The face is
+; remembered as the last one lost in a value rather than a link, which
+; would bring its ConceptNode straight back.
+;
+; Example usage:
+;   (perceive-face-lost "aef7dfsd89f8dsf9dsf97dsf")
+;   (cog-value (Concept "last-face-lost") (Predicate "face-id"))
+;
+
+(define (perceive-face-lost FACE-ID)
+ (cog-delete-recursive (ConceptNode FACE-ID))
+ (cog-set-value!
+  (ConceptNode "last-face-lost")
+  (PredicateNode "face-id")
+  (StringValue FACE-ID)))
+
+; -------------------------------------------------------------
+; A person blinked, or closed or opened their eyes. ghost_bridge follows
+; the eye states of each face and sends only these events: "blink",
+; "eyes-closed" once the eyes have been closed for a while, and
+; "eyes-opened" when they open again. The duration is how long the eyes
+; were closed for, and the stamp is when the event was perceived, both in
+; seconds.
+;
+; Example usage:
+;   (perceive-eye-event "aef7dfsd89f8dsf9dsf97dsf" "blink" 0.2 1539859200.5)
+;   (cog-execute! (Get (State (List (Concept "eye-event") (Concept "aef7dfsd89f8dsf9dsf97dsf")) (Variable "$e"))))
+;
+
+(define (perceive-eye-event FACE-ID EVENT DURATION STAMP)
+ (StateLink
+  (ListLink
+   (ConceptNode "eye-event")
+   (ConceptNode FACE-ID))
+  (ListLink
+   (ConceptNode EVENT)
+   (NumberNode DURATION)
+   (NumberNode STAMP))))
+
+; -------------------------------------------------------------
+; The id of the latency trace of the sentence ghost_bridge is about to
+; send. Ghost doesn't carry ids through its rules, so the id is kept here
+; and the action node hands it back with the answer, letting ghost_bridge
+; close the trace of the sentence that was answered.
+;
+; Only the latest sentence's id is kept. Ghost doesn't say which sentence
+; an answer is for, so when a second sentence arrives before the first is
+; answered, that answer closes the second sentence's trace and the first
+; is left open until it is abandoned. Latencies measured across
+; overlapping sentences are therefore too short.
+;
+; Example usage:
+;   (perceive-sentence-trace 42)
+;   (sentence-trace)
+;
+
+(define (perceive-sentence-trace TRACE-ID)
+ (cog-set-value!
+  (ConceptNode "ghost-bridge")
+  (PredicateNode "sentence-trace")
+  (FloatValue TRACE-ID)))
+
+(define (sentence-trace)
+ (let ((value (cog-value (ConceptNode "ghost-bridge") (PredicateNode "sentence-trace"))))
+  (if (cog-value? value) (inexact->exact (cog-value-ref value 0)) 0)))
+
+; -------------------------------------------------------------
+; A whole frame of face perceptions in one call. ghost_bridge sends this
+; once per Faces message instead of a perceive-face, perceive-eye-state
+; and perceive-emotion call for each face, so the CogServer parses and
+; evaluates one expression per frame. Each face is a list of its id, its
+; confidence, its eye states, its emotions and its new dominant emotion.
+; The confidence and dominant emotion are #f when they haven't changed.
+;
+; Example usage:
+;   (perceive-frame '(("aef7dfsd89f8dsf9dsf97dsf" 0.9 (("left" 0.8) ("right" 0.9)) (("happy" 0.7)) "happy")
+;                     ("b4e1c2d3" #f () (("sad" 0.4)) #f)))
+;
+
+(define (perceive-frame FACES)
+ (for-each
+  (lambda (FACE)
+   (let ((face-id (list-ref FACE 0))
+         (confidence (list-ref FACE 1))
+         (eyes (list-ref FACE 2))
+         (emotions (list-ref FACE 3))
+         (dominant (list-ref FACE 4)))
+    (if confidence (perceive-face face-id confidence))
+    (for-each
+     (lambda (EYE) (perceive-eye-state face-id (car EYE) (cadr EYE)))
+     eyes)
+    (for-each
+     (lambda (EMOTION) (perceive-emotion face-id (car EMOTION) (cadr EMOTION)))
+     emotions)
+    (if dominant (perceive-dominant-emotion face-id dominant))))
+  FACES))
+
+*unspecified* ; Make the load be silent
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+#
+# replay.py - Feed a recording back through the bridge
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Replays the messages of a recording, made by running ghost_bridge with
+# the ~record_path param set, through the callbacks of a GhostBridge at
+# the recorded pace (--rate 1), N times faster (--rate N) or as fast as
+# possible (--rate 0). Each channel is delivered on its own thread, as
+# rospy does for subscribers.
+#
+# Afterwards the scheme commands the bridge sent are compared, by type,
+# with those in the recording, so two versions of the bridge can be run
+# against exactly the same traffic:
+#
+#   rosrun ghost_bridge replay.py session.gbrec --rate 4 --emulator
+
+import argparse
+import json
+import sys
+import threading
+import time
+from Queue import Queue
+
+import rospy
+from roslib.message import get_message_class
+
+from ghost_bridge.emulator import CogServerEmulator, procedure_name
+from ghost_bridge.ghost_bridge_ctrl import GhostBridge
+from ghost_bridge.recorder import read_recording, INBOUND, OUTBOUND
+
+
+class ChannelDispatcher(object):
+    """
+        Delivers the messages of one channel to its callback from a thread of its own.
+    """
+
+    def __init__(self, name, callback):
+        self.name = name
+        self.callback = callback
+        self.queue = Queue()
+        self.delivered = 0
+        self.thread = threading.Thread(target=self.run, name="replay_" + name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, msg):
+        self.queue.put(msg)
+
+    def run(self):
+        while True:
+            msg = self.queue.get()
+            try:
+                if msg is None:
+                    return
+                self.callback(msg)
+                self.delivered += 1
+            except Exception as e:
+                rospy.logerr("Replaying {} failed: {}".format(self.name, e))
+            finally:
+                self.queue.task_done()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def count_commands(content, counts):
+    for line in content.splitlines():
+        if line.startswith('('):
+            name = procedure_name(line)
+            counts[name] = counts.get(name, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a ghost_bridge recording through the bridge")
+    parser.add_argument("recording")
+    parser.add_argument("--rate", type=float, default=1.0, help="speed relative to the recording, 0 for as fast as "
+                                                                "possible")
+    parser.add_argument("--channels", default=None, help="comma separated channels to replay, defaults to all")
+    parser.add_argument("--emulator", action="store_true", help="send to a stand-in CogServer instead of the real one")
+    parser.add_argument("--latency", type=float, default=0.0, help="emulated seconds to evaluate each expression")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for the bridge to send its backlog")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(rospy.myargv()[1:])
+
+    channels = None
+    if args.channels:
+        channels = set(name.strip() for name in args.channels.split(","))
+
+    rospy.init_node("ghost_bridge_replay", disable_signals=True)
+    if not rospy.has_param("robot_name"):
+        rospy.set_param("robot_name", "replay")
+
+    emulator = None
+    if args.emulator:
+        emulator = CogServerEmulator(latency=args.latency).start()
+        rospy.set_param("~cogserver_port", emulator.port)
+
+    bridge = GhostBridge()
+    dispatchers = {}
+    msg_classes = {}
+    recorded = {}
+    first = None
+    start = time.time()
+
+    for record in read_recording(args.recording):
+        if record.kind == OUTBOUND:
+            count_commands(record.payload, recorded)
+            continue
+
+        if record.kind != INBOUND or (channels is not None and record.channel not in channels):
+            continue
+
+        dispatcher = dispatchers.get(record.channel)
+        if dispatcher is None:
+            callback = bridge.inbound_callbacks.get(record.channel)
+            if callback is None:
+                rospy.logwarn("No callback for channel '{}', skipping it".format(record.channel))
+                dispatchers[record.channel] = dispatcher = ChannelDispatcher(record.channel, lambda msg: None)
+            else:
+                dispatchers[record.channel] = dispatcher = ChannelDispatcher(record.channel, callback)
+
+        msg_class = msg_classes.get(record.msg_type)
+        if msg_class is None:
+            msg_class = msg_classes[record.msg_type] = get_message_class(record.msg_type)
+
+        if first is None:
+            first = record.stamp
+        if args.rate > 0:
+            delay = start + (record.stamp - first) / args.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        dispatcher.put(msg_class().deserialize(record.payload))
+
+    for dispatcher in dispatchers.values():
+        dispatcher.queue.join()
+    elapsed = time.time() - start
+    time.sleep(args.drain)
+
+    replayed = dict((name[len("commands."):], n) for name, n in bridge.metrics.snapshot().items()
+                    if name.startswith("commands."))
+    results = {
+        "elapsed": elapsed,
+        "delivered": dict((name, dispatcher.delivered) for name, dispatcher in dispatchers.items()),
+        "commands_recorded": recorded,
+        "commands_replayed": replayed,
+        "dropped": bridge.backend.dropped(),
+        "transport": bridge.transport_state()
+    }
+    if emulator is not None:
+        results["emulator"] = emulator.stats()
+
+    for dispatcher in dispatchers.values():
+        dispatcher.stop()
+    bridge.shutdown()
+    if emulator is not None:
+        emulator.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("Replayed in {:.1f}s: {}".format(elapsed, ", ".join(
+            "{} {}".format(n, name) for name, n in sorted(results["delivered"].items()))))
+        print("{:<32} {:>10} {:>10}".format("command", "recorded", "replayed"))
+        for name in sorted(set(recorded) | set(replayed)):
+            print("{:<32} {:>10} {:>10}".format(name, recorded.get(name, 0), replayed.get(name, 0)))
+        print("{} perceptions dropped".format(results["dropped"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,25 @@
-from . import netcat, action_ctrl, perception_ctrl, action_feedback_ctrl, face_tracker_ctrl, ghost_bridge_ctrl
+from . import constants, netcat, cogserver, sender, perception_cache, emotion_aggregator, face_selector, rate_controller, metrics, tracing, emulator, recorder, scheme_encoder, backends, perception_store, eye_events, face_registry, face_perception, motion_model, face_table, action_ctrl, perception_ctrl, action_feedback_ctrl, face_tracker_ctrl, ghost_bridge_ctrl
+from .constants import *
 from .action_ctrl import *
 from .netcat import *
+from .cogserver import *
+from .sender import *
+from .perception_cache import *
+from .emotion_aggregator import *
+from .face_selector import *
+from .rate_controller import *
+from .metrics import *
+from .tracing import *
+from .emulator import *
+from .recorder import *
+from .scheme_encoder import *
+from .backends import *
+from .perception_store import *
+from .eye_events import *
+from .face_registry import *
+from .face_perception import *
+from .motion_model import *
+from .face_table import *
 from .action_feedback_ctrl import *
 from .perception_ctrl import *
 from .face_tracker_ctrl import *
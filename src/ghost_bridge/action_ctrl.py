@@ -18,6 +18,9 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import logging
+import threading
+import time
+from collections import OrderedDict
 
 import rospy
 from blender_api_msgs.msg import AvailableEmotionStates, AvailableGestures
@@ -30,7 +33,12 @@ from ghost_bridge.msg import GhostSay
 from blender_api_msgs.srv import SetParam
 from std_msgs.msg import String
 from actionlib import SimpleActionClient
-from ghost_bridge.msg import GazeAction, GazeGoal
+from actionlib_msgs.msg import GoalStatus
+from ghost_bridge.msg import GazeAction, GazeGoal, GazeRetarget
+from ghost_bridge.face_registry import FaceHandleResolver, FACE_HANDLES_PARAM
+from ghost_bridge.constants import EMOTION_MAP, EYE_MAP, PERCEPTION_CACHE_MAX_AGE
+from ghost_bridge.perception_store import PerceptionStore
+from ros_people_model.msg import Faces
 
 logger = logging.getLogger('hr.ghost_bridge_actions')
 
@@ -55,6 +63,10 @@ class ActionCtrl:
     BPY_PARAM_SACCADE = "bpy.data.scenes[\"Scene\"].actuators.ACT_saccade.HEAD_PARAM_enabled"
     BPY_PARAM_BLINK = "bpy.data.scenes[\"Scene\"].actuators.ACT_blink_randomly.HEAD_PARAM_enabled"
 
+    # The actions that need a server or service which may not be up yet
+    GAZE_ACTIONS = ("gaze-at", "gaze-at-cancel")
+    SET_PARAM_ACTIONS = ("blink-cancel", "saccade-cancel")
+
     def __init__(self):
         # The below will hang until roscore is started!
         rospy.loginfo("Starting ghost_bridge_actions node")
@@ -78,23 +90,115 @@ class ActionCtrl:
         # blender set param
         self.blender_set_param_srv = rospy.ServiceProxy('/blender_api/set_param', SetParam)
 
-        # Create gaze action client and wait for server
+        # Create gaze action client. The gaze server and the set_param service are waited for in the background, so
+        # the action layer doesn't hang until the face tracker and blender are up. Actions asked for before then are
+        # queued, only the latest gaze_at and the latest value of each param are kept.
         self.gaze_goal = None
         self.gaze_client = SimpleActionClient('/gaze_action', GazeAction)
-        self.gaze_client.wait_for_server()
+        self.gaze_ready = threading.Event()
+        self.set_param_ready = threading.Event()
+        self.pending_lock = threading.Lock()
+        self.pending_gaze = None  # (face_id, speed)
+        self.pending_params = OrderedDict()  # param -> value
+
+        # With ~gaze_update_mode, gaze_at points a running gaze goal at the new face instead of replacing the goal
+        self.gaze_update_mode = rospy.get_param("~gaze_update_mode", False)
+        self.gaze_retarget_pub = rospy.Publisher("/gaze_action/retarget", GazeRetarget, queue_size=1)
+
+        # The recent perceptions of each face, which Ghost rules query through grounded predicates rather than
+        # having them all pushed into the atomspace. The raw faces are only subscribed to with ~perception_store,
+        # as the action node runs inside of the CogServer, otherwise the store stays empty.
+        self.perception_store = PerceptionStore([name for i, name in sorted(EMOTION_MAP.items())],
+                                                [name for i, name in sorted(EYE_MAP.items())],
+                                                history=rospy.get_param("~perception_store_history", 10.0),
+                                                max_rate=rospy.get_param("~perception_store_max_rate", 30.0),
+                                                max_faces=rospy.get_param("~perception_store_max_faces", 16))
+        self.perception_store_pruned = time.time()
+        self.face_handles = FaceHandleResolver(rospy.get_param("~face_handles_param", FACE_HANDLES_PARAM))
+        if rospy.get_param("~perception_store", False):
+            rospy.Subscriber('/faces', Faces, self.faces_cb, queue_size=1)
 
         # Subscribers to get the available emotions and gestures
         rospy.Subscriber("/blender_api/available_emotion_states", AvailableEmotionStates, self.get_emotions_cb)
         rospy.Subscriber("/blender_api/available_gestures", AvailableGestures, self.get_gestures_cb)
 
-    def say(self, text, fallback_id):
+        self.connect_thread = threading.Thread(target=self.connect, name="action_ctrl_connect")
+        self.connect_thread.daemon = True
+        self.connect_thread.start()
+
+    def connect(self):
+        """ Wait for the gaze action server and the blender set_param service, then do what was queued for them
+
+        :return: None
+        """
+
+        while not rospy.is_shutdown() and not (self.gaze_ready.is_set() and self.set_param_ready.is_set()):
+            if not self.gaze_ready.is_set() and self.gaze_client.wait_for_server(rospy.Duration(0.5)):
+                with self.pending_lock:
+                    self.gaze_ready.set()
+                    pending = self.pending_gaze
+                    self.pending_gaze = None
+                rospy.loginfo("Connected to /gaze_action")
+                if pending is not None:
+                    self.gaze_at(*pending)
+
+            if not self.set_param_ready.is_set():
+                try:
+                    self.blender_set_param_srv.wait_for_service(timeout=0.5)
+                except rospy.ROSException:
+                    continue
+                with self.pending_lock:
+                    self.set_param_ready.set()
+                    pending = list(self.pending_params.items())
+                    self.pending_params.clear()
+                rospy.loginfo("Connected to /blender_api/set_param")
+                for param, value in pending:
+                    try:
+                        self.set_blender_param(param, value)
+                    except rospy.ServiceException, e:
+                        rospy.logerr("Setting queued param {} failed: {}".format(param, e))
+
+    def is_ready(self, action):
+        """ Whether the server or service an action needs is up
+
+        :param str action: the name of the action, e.g. 'gaze-at'
+        :return: bool
+        """
+
+        if action in ActionCtrl.GAZE_ACTIONS:
+            return self.gaze_ready.is_set()
+        if action in ActionCtrl.SET_PARAM_ACTIONS:
+            return self.set_param_ready.is_set()
+        return True
+
+    def set_blender_param(self, param, value):
+        """ Set a blender param, or queue it until the set_param service is up
+
+        :param str param: the blender param
+        :param str value: its value
+        :return: True if it was set
+        """
+
+        with self.pending_lock:
+            if not self.set_param_ready.is_set():
+                self.pending_params[param] = value
+                rospy.logwarn("/blender_api/set_param isn't up yet, queued {}={}".format(param, value))
+                return False
+
+        self.blender_set_param_srv(param, value)
+        return True
+
+    def say(self, text, fallback_id, trace_id=0):
         """ Make the robot vocalize text
 
         :param str text: the text to vocalize
         :param str fallback_id: the id of the engine to fallback too
+        :param int trace_id: the latency trace of the sentence being answered, 0 if not known
         :return: None
         """
         msg = GhostSay()
+        msg.stamp = rospy.Time.now()
+        msg.trace_id = trace_id
         msg.text = text
         msg.fallback_id = fallback_id
 
@@ -114,6 +218,19 @@ class ActionCtrl:
         rospy.logdebug("published shutup")
 
     def gaze_at(self, face_id, speed):
+        with self.pending_lock:
+            if not self.gaze_ready.is_set():
+                self.pending_gaze = (face_id, speed)
+                rospy.logwarn("/gaze_action isn't up yet, queued gaze_at(face_id={})".format(face_id))
+                return
+
+        if self.gaze_update_mode and self.gaze_goal is not None and \
+                self.gaze_client.get_state() in (GoalStatus.PENDING, GoalStatus.ACTIVE):
+            self.gaze_goal.target = face_id
+            self.gaze_retarget_pub.publish(GazeRetarget(stamp=rospy.Time.now(), target=face_id))
+            rospy.logdebug("published gaze_at retarget(face_id={}, speed={})".format(face_id, speed))
+            return
+
         self.gaze_goal = GazeGoal(target=face_id)
         self.gaze_client.send_goal(self.gaze_goal, done_cb=self.done_cb)
         rospy.logdebug("published gaze_at(face_id={}, speed={})".format(face_id, speed))
@@ -122,6 +239,11 @@ class ActionCtrl:
         rospy.logdebug("DONE")
 
     def gaze_at_cancel(self):
+        with self.pending_lock:
+            self.pending_gaze = None
+            if not self.gaze_ready.is_set():
+                return
+
         self.gaze_client.cancel_all_goals()
         self.gaze_goal = None
         rospy.logdebug("published gaze_at_cancel()")
@@ -143,8 +265,8 @@ class ActionCtrl:
 
     def blink_cancel(self):
         try:
-            self.blender_set_param_srv(ActionCtrl.BPY_PARAM_BLINK, "False")
-            rospy.logdebug("blink_cancel: blender_api/set_param service called")
+            if self.set_blender_param(ActionCtrl.BPY_PARAM_BLINK, "False"):
+                rospy.logdebug("blink_cancel: blender_api/set_param service called")
         except rospy.ServiceException, e:
             rospy.logerr("blink_cancel: blender_api/set_param service call failed %s" % e)
 
@@ -191,8 +313,8 @@ class ActionCtrl:
 
     def saccade_cancel(self):
         try:
-            self.blender_set_param_srv(ActionCtrl.BPY_PARAM_SACCADE, "False")
-            rospy.logdebug("saccade_cancel: blender_api/set_param service called")
+            if self.set_blender_param(ActionCtrl.BPY_PARAM_SACCADE, "False"):
+                rospy.logdebug("saccade_cancel: blender_api/set_param service called")
         except rospy.ServiceException, e:
             rospy.logerr("saccade_cancel: blender_api/set_param service call failed %s" % e)
 
@@ -278,6 +400,21 @@ class ActionCtrl:
 
         rospy.logdebug("soma_cancel: {}".format(name))
 
+    def faces_cb(self, msg):
+        """ Keep the perceptions of each face for Ghost to query
+
+        :param ros_people_model.msg.Faces msg: the faces in view
+        :return: None
+        """
+
+        now = time.time()
+        self.perception_store.add_faces(msg.faces, now)
+
+        # Forget the faces that have left the view
+        if now - self.perception_store_pruned > PERCEPTION_CACHE_MAX_AGE:
+            self.perception_store.prune(PERCEPTION_CACHE_MAX_AGE, now)
+            self.perception_store_pruned = now
+
     def get_emotions_cb(self, msg):
         """ Log the available emotions
 
@@ -1,4 +1,5 @@
-from ghost_bridge.netcat import netcat
+from ghost_bridge.backends import SocketBackend
+from ghost_bridge.sender import CONVERSATION
 
 
 class ActionFeedbackCtrl:
@@ -7,18 +8,36 @@ class ActionFeedbackCtrl:
         that are being executed on the robot.
     """
 
-    def __init__(self, hostname, port):
+    def __init__(self, hostname, port, backend=None, metrics=None):
         self.hostname = hostname
         self.port = port
 
+        # The backend delivers the commands, and can be shared with the PerceptionCtrl
+        if backend is None:
+            backend = SocketBackend(hostname, port)
+        self.backend = backend
+
+        # Counts the commands sent, and their bytes, by type
+        self.metrics = metrics
+
+    def command(self, name):
+        """ Send a feedback command in the conversation lane
+
+        :param str name: the name of the scheme procedure, one of scheme_encoder.COMMANDS
+        :return: 0 on success, non-zero on failure
+        """
+
+        if self.metrics is not None:
+            self.metrics.count_command(name, len("({})\n".format(name)))
+        return self.backend.command(name, (), CONVERSATION)
+
     def say_started(self):
         """ Notify Ghost that the say command has started
 
         :return: None
         """
 
-        content = '(say-started)\n'
-        netcat(self.hostname, self.port, content)
+        self.command("say-started")
 
     def say_finished(self):
         """ Notify Ghost that the say command has finished
@@ -26,5 +45,4 @@ class ActionFeedbackCtrl:
         :return: None
         """
 
-        content = '(say-finished)\n'
-        netcat(self.hostname, self.port, content)
+        self.command("say-finished")
@@ -0,0 +1,317 @@
+#
+# backends.py - Where perception and action feedback commands are delivered.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import abc
+import threading
+import time
+
+import rospy
+from ghost_bridge.cogserver import CogServerPool, CircuitBreaker
+from ghost_bridge.scheme_encoder import SchemeEncoder
+from ghost_bridge.sender import AsyncSender, TELEMETRY
+
+
+# PerceptionCtrl and ActionFeedbackCtrl hand their commands, e.g.
+# perceive-face with its arguments, to a backend:
+#
+#   SocketBackend     encodes them as scheme and sends them to the CogServer
+#                     over TCP. The ctrls batch the encoded commands.
+#   InProcessBackend  evaluates them in the atomspace of the CogServer the
+#                     code is running in, e.g. from the action node.
+#   FakeBackend       keeps them in memory, to see what the ctrls would
+#                     send without a CogServer.
+
+class Backend(object):
+    """
+        Delivers perception and action feedback commands to Ghost. Subclasses must implement command() and send().
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    # Whether the ctrls should encode and batch commands, and send() them
+    batched = False
+
+    @abc.abstractmethod
+    def command(self, name, args, lane=TELEMETRY):
+        """ Deliver one command
+
+        :param str name: the name of the scheme procedure, one of scheme_encoder.COMMANDS
+        :param tuple args: the arguments of the procedure
+        :param int lane: the sender lane, CONVERSATION or TELEMETRY
+        :return: 0 on success, non-zero on failure
+        """
+
+    @abc.abstractmethod
+    def send(self, content, lane=TELEMETRY):
+        """ Deliver encoded commands
+
+        :param str content: newline terminated scheme expressions
+        :param int lane: the sender lane, CONVERSATION or TELEMETRY
+        :return: 0 on success, non-zero on failure
+        """
+
+    def latency(self):
+        """ Moving average of the seconds it takes Ghost to take a command
+
+        :return: float
+        """
+
+        return 0.0
+
+    def queue_depth(self):
+        """ The number of telemetry commands waiting to be delivered
+
+        :return: int
+        """
+
+        return 0
+
+    def pipeline_depth(self):
+        """ The share of the commands Ghost may be behind by that it is behind by, from 0.0 to 1.0
+
+        :return: float
+        """
+
+        return 0.0
+
+    def stalls(self):
+        """ The number of deliveries that timed out waiting for Ghost to catch up
+
+        :return: int
+        """
+
+        return 0
+
+    def dropped(self):
+        """ The number of commands that were never delivered
+
+        :return: int
+        """
+
+        return 0
+
+    def is_available(self):
+        """ Whether commands are being let through to Ghost, i.e. the circuit breaker is closed
+
+        :return: bool
+        """
+
+        return True
+
+    def is_healthy(self):
+        return True
+
+    def health(self):
+        return {}
+
+    def state(self):
+        """ Statistics for the diagnostics
+
+        :return: dict
+        """
+
+        return {}
+
+    def close(self):
+        pass
+
+
+class SocketBackend(Backend):
+    """
+        Sends commands to the CogServer over TCP, from a background thread.
+    """
+
+    batched = True
+
+    def __init__(self, hostname, port, sessions=1, pipelined=True, maxsize=256, telemetry_max_age=2.0,
+                 conversation_max_age=60.0, precision=3, metrics=None, recorder=None):
+        """
+        :param str hostname: the CogServer host
+        :param int port: the CogServer port
+        :param int sessions: the number of sessions kept open to the CogServer
+        :param bool pipelined: use the pipelined protocol, see cogserver.py
+        :param int maxsize: the number of telemetry commands queued before the oldest is dropped
+        :param float telemetry_max_age: seconds after which queued telemetry is too stale to send
+        :param float conversation_max_age: seconds after which queued conversation is too stale to replay
+        :param int precision: the number of decimal places numbers are sent with
+        :param ghost_bridge.metrics.Metrics metrics: records write counts, bytes, errors and latencies if given
+        :param ghost_bridge.recorder.Recorder recorder: records everything sent if given
+        """
+
+        self.cogserver = CogServerPool(hostname, port, size=sessions, pipelined=pipelined,
+                                       resend_max_age=conversation_max_age)
+        self.sender = AsyncSender(self.cogserver, maxsize=maxsize, telemetry_max_age=telemetry_max_age,
+                                  conversation_max_age=conversation_max_age, metrics=metrics, recorder=recorder)
+        self.encoder = SchemeEncoder(precision)
+
+    def command(self, name, args, lane=TELEMETRY):
+        return self.sender.send(self.encoder.encode(name, *args), lane)
+
+    def send(self, content, lane=TELEMETRY):
+        return self.sender.send(content, lane)
+
+    def latency(self):
+        # With pipelining a write returns once the payload is on the socket, so what counts is how long payloads
+        # wait to be acknowledged: the moving average, or the oldest one still waiting if that is worse
+        if self.cogserver.pipelined:
+            return max(self.cogserver.rtt(), self.cogserver.unacked_age())
+        return self.sender.send_latency
+
+    def queue_depth(self):
+        return len(self.sender.lanes[TELEMETRY].queue)
+
+    def pipeline_depth(self):
+        return self.cogserver.pipeline_depth()
+
+    def stalls(self):
+        return self.cogserver.stalls()
+
+    def dropped(self):
+        return self.sender.dropped
+
+    def is_available(self):
+        return self.cogserver.breaker.state == CircuitBreaker.CLOSED
+
+    def is_healthy(self):
+        return self.cogserver.is_healthy()
+
+    def health(self):
+        return self.cogserver.health()
+
+    def state(self):
+        state = {}
+        for lane, lane_stats in self.sender.stats().items():
+            for key, value in lane_stats.items():
+                state["lane.{}.{}".format(lane, key)] = value
+        state["circuit"] = self.cogserver.breaker.state
+        state["connected_sessions"] = sum(conn.is_connected() for conn in self.cogserver.connections)
+        state["cogserver_rtt"] = self.cogserver.rtt()
+        state["cogserver_unacked_age"] = self.cogserver.unacked_age()
+        state["pipeline_depth"] = self.cogserver.pipeline_depth()
+        state["stalls"] = self.cogserver.stalls()
+        state["eval_errors"] = self.cogserver.eval_errors()
+        return state
+
+    def close(self):
+        self.sender.stop()
+        self.cogserver.close()
+
+
+class InProcessBackend(Backend):
+    """
+        Evaluates commands directly in the atomspace of the CogServer this code is running inside of, as the action
+        node does. There is no socket, send thread or framing. The perceive-* procedures are scheme, so each command
+        is still evaluated as a short scheme expression.
+    """
+
+    def __init__(self, atomspace=None, precision=3, recorder=None):
+        """
+        :param atomspace: the atomspace to evaluate in, defaults to the CogServer's
+        :param int precision: the number of decimal places numbers are passed with
+        :param ghost_bridge.recorder.Recorder recorder: records everything evaluated if given
+        """
+
+        # Only available inside of the CogServer's python
+        from opencog.scheme_wrapper import scheme_eval, scheme_eval_as
+
+        self.scheme_eval = scheme_eval
+        self.atomspace = atomspace if atomspace is not None else scheme_eval_as("(cog-atomspace)")
+        self.encoder = SchemeEncoder(precision)
+        self.recorder = recorder
+
+        self.lock = threading.Lock()
+        self.evaluated = 0
+        self.eval_errors = 0
+        self.last_eval_error = None
+        self.eval_latency = 0.0
+
+    def command(self, name, args, lane=TELEMETRY):
+        return self.send(self.encoder.encode(name, *args), lane)
+
+    def send(self, content, lane=TELEMETRY):
+        if self.recorder is not None:
+            self.recorder.outbound(content, lane)
+
+        with self.lock:
+            start = time.time()
+            try:
+                self.scheme_eval(self.atomspace, content)
+                result = 0
+            except Exception as e:
+                self.eval_errors += 1
+                self.last_eval_error = "{}: {}".format(content.strip(), e)
+                rospy.logwarn_throttle(5.0, "Scheme error in a perception: {}".format(self.last_eval_error))
+                result = 1
+            self.evaluated += 1
+            self.eval_latency = 0.8 * self.eval_latency + 0.2 * (time.time() - start)
+        return result
+
+    def latency(self):
+        return self.eval_latency
+
+    def state(self):
+        return {
+            "evaluated": self.evaluated,
+            "eval_errors": self.eval_errors,
+            "eval_latency": self.eval_latency
+        }
+
+
+class FakeBackend(Backend):
+    """
+        Keeps the commands it is given in memory, to see what the ctrls would send without a CogServer.
+
+        Example:
+            backend = FakeBackend()
+            ctrl = PerceptionCtrl("localhost", 17001, backend=backend)
+            ctrl.perceive_word("a4f3", "hello")
+            backend.commands  # [('perceive-word', ('a4f3', 'hello'), 0)]
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = []  # (name, args, lane)
+        self.sent = []  # (content, lane)
+
+    def command(self, name, args, lane=TELEMETRY):
+        with self.lock:
+            self.commands.append((name, args, lane))
+        return 0
+
+    def send(self, content, lane=TELEMETRY):
+        with self.lock:
+            self.sent.append((content, lane))
+        return 0
+
+    def names(self):
+        """ The names of the commands given so far, in order
+
+        :return: list of str
+        """
+
+        with self.lock:
+            return [name for name, args, lane in self.commands]
+
+    def clear(self):
+        with self.lock:
+            self.commands = []
+            self.sent = []
+
+    def state(self):
+        return {"commands": len(self.commands)}
@@ -0,0 +1,610 @@
+#
+# cogserver.py - Long-lived connections to the CogServer shell.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import select
+import socket
+import threading
+import time
+from Queue import Queue
+from collections import OrderedDict
+
+import rospy
+
+
+# netcat() opens a socket per scheme snippet, which costs a TCP handshake
+# and leaves a TIME_WAIT socket behind for every perception. The classes
+# here keep sessions to the CogServer open instead, and reconnect when the
+# CogServer goes away. The line protocol is the same one netcat() speaks:
+# each snippet is a newline terminated scheme expression.
+#
+# While the CogServer is down (e.g. it is still starting up, or has
+# crashed) a circuit breaker stops every send from trying to connect.
+# Connection attempts back off exponentially until one succeeds.
+#
+# Sessions are pipelined: many payloads are written without waiting for
+# the ones before to be evaluated. Each command is wrapped so that it
+# reports its own evaluation errors, and each payload ends with an
+# acknowledgement, so a reader thread can match the output to the
+# payloads:
+#
+#   sent:     (ghost-bridge-try 17 (perceive-face "a4f3" 0.9))
+#             (ghost-bridge-ack 17)
+#   received: ghost-bridge err 17 unbound-variable (perceive-face "a4f3" 0.9) (...)
+#             guile> ghost-bridge ok 17
+#             guile>
+#
+# A payload can be kept by the session until it is acknowledged, as the
+# conversation is. If the session is lost first, whether the payload was
+# evaluated is unknown, so the kept payloads are resent in order on the
+# next socket, ahead of anything new. The others are counted as lost.
+#
+# The shell isn't hushed, since in quiet mode it doesn't pass on what the
+# wrappers display either. It still prompts after every expression, with
+# no newline, so the reports are found by their marker wherever they are
+# in a line, and everything else the shell sends is ignored. The wrappers
+# are defined by the session itself when it connects.
+
+MARKER = "ghost-bridge "
+
+PREAMBLE = (
+    '(define-syntax ghost-bridge-try (syntax-rules () ((_ id expr) (catch #t (lambda () expr *unspecified*) '
+    '(lambda (key . args) (display (format #f "ghost-bridge err ~a ~a ~s ~s\\n" id key (quote expr) args)))))))\n'
+    '(define (ghost-bridge-ack id) (display (format #f "ghost-bridge ok ~a\\n" id)))\n'
+)
+
+
+def frame(request_id, content):
+    """ Wrap newline terminated scheme expressions for the pipelined protocol
+
+    :param int request_id: the id the acknowledgement carries
+    :param str content: newline terminated scheme expressions, one per line
+    :return: str
+    """
+
+    lines = ["(ghost-bridge-try {} {})\n".format(request_id, line) for line in content.splitlines() if line]
+    lines.append("(ghost-bridge-ack {})\n".format(request_id))
+    return ''.join(lines)
+
+
+class CircuitBreaker(object):
+    """
+        Tracks whether the CogServer is reachable. After a failure the circuit opens and sends are refused until a
+        backoff expires, then a single probe is let through (half-open). A successful probe closes the circuit, a
+        failed one opens it again with twice the backoff.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, initial_backoff=0.5, max_backoff=30.0):
+        self.name = name
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.state = CircuitBreaker.CLOSED
+        self.backoff = initial_backoff
+        self.opened_time = None
+        self.retry_time = 0.0
+        self.lock = threading.Lock()
+
+    def retry_in(self, now=None):
+        """ Seconds until a send will be let through, 0 if it would be now
+
+        :return: float
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            if self.state == CircuitBreaker.OPEN:
+                return max(0.0, self.retry_time - now)
+            return 0.0
+
+    def allow(self, now=None):
+        """ Whether a send may go ahead. Moves an open circuit whose backoff has expired to half-open.
+
+        :return: bool
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+            if self.state == CircuitBreaker.OPEN and now >= self.retry_time:
+                self.state = CircuitBreaker.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CircuitBreaker.CLOSED:
+                rospy.loginfo("{} reachable again after {:.1f}s".format(self.name, time.time() - self.opened_time))
+            self.state = CircuitBreaker.CLOSED
+            self.backoff = self.initial_backoff
+            self.opened_time = None
+
+    def record_failure(self, now=None):
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            if self.state == CircuitBreaker.CLOSED:
+                rospy.logerr("{} unreachable, backing off".format(self.name))
+                self.opened_time = now
+            elif self.state == CircuitBreaker.HALF_OPEN:
+                self.backoff = min(self.max_backoff, self.backoff * 2.0)
+                rospy.logdebug("{} still unreachable, retrying in {:.1f}s".format(self.name, self.backoff))
+
+            self.state = CircuitBreaker.OPEN
+            self.retry_time = now + self.backoff
+
+
+class CogServerConnection(object):
+    """
+        A single persistent session to the CogServer shell.
+    """
+
+    def __init__(self, hostname, port, timeout=2.0, pipelined=True, max_outstanding=64, resend_max_age=60.0):
+        """
+        :param str hostname: the CogServer host
+        :param int port: the CogServer port
+        :param float timeout: seconds to wait for a connection, a write, or space in the pipeline
+        :param bool pipelined: use the framed protocol; otherwise replies are read and thrown away
+        :param int max_outstanding: the most pipelined payloads sent but not yet acknowledged
+        :param float resend_max_age: seconds after first being sent that a kept payload is too stale to resend
+        """
+
+        self.hostname = hostname
+        self.port = port
+        self.timeout = timeout
+        self.pipelined = pipelined
+        self.max_outstanding = max_outstanding
+        self.resend_max_age = resend_max_age
+
+        self.sock = None
+        self.lock = threading.Lock()
+
+        # Pipelined payloads waiting to be acknowledged, guarded by their own
+        # condition so the reader thread never waits on a send
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()  # request id -> (time sent, kept content or None, time first sent)
+        self.unacked = []  # (time sent, content, time first sent) of the kept payloads a lost socket didn't ack
+        self.next_id = 0
+        self.alive = False
+
+        # Health counters
+        self.connects = 0
+        self.failures = 0
+        self.sent = 0
+        self.acked = 0
+        self.lost = 0
+        self.resent = 0
+        self.stalls = 0
+        self.eval_errors = 0
+        self.rtt = 0.0
+        self.last_error = None
+        self.last_eval_error = None
+        self.last_success_time = None
+
+    def is_connected(self):
+        return self.sock is not None and (self.alive or not self.pipelined)
+
+    def connect(self):
+        """ Open the session if it isn't open already
+
+        :return: True if the session is open
+        """
+
+        with self.lock:
+            return self._connect()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def send(self, content, keep=False):
+        """ Send content to the CogServer, reconnecting once if the session has gone stale. In pipelined mode this
+        returns once the content is written, its acknowledgement is matched up by the reader thread.
+
+        :param str content: newline terminated scheme expressions
+        :param bool keep: in pipelined mode, keep the content until it is acknowledged, and resend it if the
+                          session is lost before then
+        :return: 0 on success, non-zero on failure (same as netcat)
+        """
+
+        with self.lock:
+            for attempt in range(2):
+                if self.sock is not None and not self.is_connected():
+                    self._close()
+                if self.sock is None and not self._connect():
+                    break
+
+                request_id = None
+                payload = content
+                if self.pipelined:
+                    request_id = self._reserve(content if keep else None)
+                    if request_id is None:
+                        if self.alive:
+                            self.stalls += 1
+                            self.last_error = "no acknowledgement from CogServer for {}s".format(self.timeout)
+                            rospy.logwarn("CogServer session to {}:{} stalled".format(self.hostname, self.port))
+                        self._close()
+                        continue
+                    payload = frame(request_id, content)
+
+                try:
+                    self.sock.sendall(payload)
+                    if not self.pipelined:
+                        self._drain()
+                    self.sent += 1
+                    self.last_success_time = time.time()
+                    return 0
+                except socket.error as e:
+                    self.last_error = str(e)
+                    rospy.logwarn("CogServer session to {}:{} lost: {}".format(self.hostname, self.port, e))
+                    # The content wasn't sent, the caller hears about it rather than it being resent or lost
+                    with self.cond:
+                        self.pending.pop(request_id, None)
+                    self._close()
+
+            self.failures += 1
+            return 1
+
+    def health(self):
+        return {
+            "connected": self.is_connected(),
+            "connects": self.connects,
+            "failures": self.failures,
+            "sent": self.sent,
+            "acked": self.acked,
+            "outstanding": len(self.pending),
+            "lost": self.lost,
+            "resent": self.resent,
+            "unacked": len(self.unacked),
+            "stalls": self.stalls,
+            "eval_errors": self.eval_errors,
+            "rtt": self.rtt,
+            "last_error": self.last_error,
+            "last_eval_error": self.last_eval_error,
+            "last_success_time": self.last_success_time
+        }
+
+    def pipeline_depth(self):
+        """ The share of the pipeline sent but not yet acknowledged
+
+        :return: float, from 0.0 to 1.0
+        """
+
+        if not self.pipelined:
+            return 0.0
+        return min(1.0, len(self.pending) / float(self.max_outstanding))
+
+    def unacked_age(self, now=None):
+        """ Seconds the oldest payload sent but not yet acknowledged has been waiting
+
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: float, 0.0 if every payload has been acknowledged
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self.cond:
+            if not self.pending:
+                return 0.0
+            return max(0.0, now - next(iter(self.pending.values()))[0])
+
+    def _connect(self):
+        if self.sock is not None:
+            return True
+
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # If the cogserver is down, the connection will fail. The circuit
+        # breaker reports that, so don't flood the log here.
+        try:
+            s.connect((self.hostname, self.port))
+            if self.pipelined:
+                s.sendall(PREAMBLE)
+        except socket.error as msg:
+            rospy.logdebug("Connect failed: %s" % msg)
+            self.last_error = str(msg)
+            s.close()
+            return False
+
+        self.sock = s
+        self.connects += 1
+        if self.connects > 1:
+            rospy.loginfo("Reconnected to CogServer at {}:{}".format(self.hostname, self.port))
+
+        if self.pipelined:
+            with self.cond:
+                self.alive = True
+            reader = threading.Thread(target=self._read, args=(s,), name="cogserver_reader")
+            reader.daemon = True
+            reader.start()
+            self._resend()
+        return self.sock is not None
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+        with self.cond:
+            self.alive = False
+            if self.pending:
+                # Whether these were evaluated is unknown. The kept ones are resent on the next socket.
+                kept = [entry for entry in self.pending.values() if entry[1] is not None]
+                self.unacked.extend(kept)
+                self.lost += len(self.pending) - len(kept)
+                rospy.logwarn("{} payloads sent to the CogServer were not acknowledged, {} will be resent".format(
+                    len(self.pending), len(kept)))
+                self.pending.clear()
+            self.cond.notify_all()
+
+    def _resend(self):
+        # Send the kept payloads the last socket lost, in order, before anything new
+        resend, self.unacked = self.unacked, []
+        now = time.time()
+        for i, (sent_time, content, first_sent) in enumerate(resend):
+            if now - first_sent > self.resend_max_age:
+                self.lost += 1
+                continue
+
+            request_id = self._reserve(content, first_sent)
+            if request_id is None:
+                self._close()
+                self.unacked = self.unacked + resend[i:]
+                return
+
+            try:
+                self.sock.sendall(frame(request_id, content))
+                self.resent += 1
+            except socket.error as e:
+                self.last_error = str(e)
+                rospy.logwarn("CogServer session to {}:{} lost: {}".format(self.hostname, self.port, e))
+                with self.cond:
+                    self.pending.pop(request_id, None)
+                self._close()
+                self.unacked = self.unacked + resend[i:]
+                return
+
+    def _reserve(self, content=None, first_sent=None):
+        # Wait for room in the pipeline, so the CogServer is never more than
+        # max_outstanding payloads behind
+        deadline = time.time() + self.timeout
+        with self.cond:
+            while self.alive and len(self.pending) >= self.max_outstanding:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+            if not self.alive:
+                return None
+            request_id = self.next_id
+            self.next_id += 1
+            now = time.time()
+            self.pending[request_id] = (now, content, first_sent if first_sent is not None else now)
+            return request_id
+
+    def _read(self, sock):
+        # Runs for the life of one socket, matching response lines to requests
+        data = ""
+        while True:
+            try:
+                chunk = sock.recv(4096)
+            except socket.timeout:
+                if self.sock is not sock:
+                    return
+                continue
+            except socket.error:
+                chunk = ""
+
+            if not chunk:
+                with self.cond:
+                    if self.sock is sock:
+                        self.alive = False
+                    self.cond.notify_all()
+                return
+
+            data += chunk
+            lines = data.split("\n")
+            data = lines.pop()
+            for line in lines:
+                self._response(sock, line.strip())
+
+    def _response(self, sock, line):
+        # Skip past the prompts in front of a report, and ignore the prompts and results around them
+        start = line.find(MARKER)
+        if start < 0:
+            return
+        line = line[start + len(MARKER):]
+
+        if line.startswith("ok "):
+            try:
+                request_id = int(line[3:])
+            except ValueError:
+                return
+
+            now = time.time()
+            with self.cond:
+                # Output still arriving from a socket that has since been closed or replaced belongs to payloads
+                # that were already counted as lost, it mustn't acknowledge the new socket's payloads
+                if self.sock is not sock:
+                    return
+
+                # Payloads are evaluated in order, so everything up to this one is done
+                while self.pending:
+                    pending_id = next(iter(self.pending))
+                    if pending_id > request_id:
+                        break
+                    sent_time = self.pending.pop(pending_id)[0]
+                    self.acked += 1
+                    if pending_id == request_id:
+                        self.rtt = 0.8 * self.rtt + 0.2 * (now - sent_time)
+                        break
+                self.cond.notify_all()
+        elif line.startswith("err "):
+            if self.sock is not sock:
+                return
+            self.eval_errors += 1
+            self.last_eval_error = line[4:]
+            rospy.logwarn_throttle(5.0, "Scheme error in a command sent to the CogServer: {}".format(line[4:]))
+        else:
+            rospy.logdebug("Unexpected output from CogServer: {}".format(line))
+
+    def _drain(self):
+        # The shell echoes prompts and results back. Nobody reads them, but
+        # if they are left in the socket the CogServer will eventually block
+        # writing to us, so throw away whatever is waiting.
+        while True:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if not readable:
+                return
+
+            data = self.sock.recv(4096)
+            if not data:
+                raise socket.error("connection closed by CogServer")
+
+
+class CogServerPool(object):
+    """
+        A fixed size pool of CogServer sessions that can be shared between the
+        PerceptionCtrl and the ActionFeedbackCtrl. Each send borrows a session,
+        so concurrent ROS callbacks never interleave on the same socket.
+        Sends are refused without touching the network while the circuit
+        breaker is open.
+    """
+
+    def __init__(self, hostname, port, size=1, timeout=2.0, pipelined=True, max_outstanding=64,
+                 resend_max_age=60.0):
+        self.hostname = hostname
+        self.port = port
+        self.pipelined = pipelined
+        self.connections = [CogServerConnection(hostname, port, timeout, pipelined, max_outstanding, resend_max_age)
+                            for i in range(max(1, size))]
+        self.breaker = CircuitBreaker("CogServer at {}:{}".format(hostname, port))
+
+        self.idle = Queue()
+        for conn in self.connections:
+            self.idle.put(conn)
+
+    def send(self, content, keep=False):
+        """ Send content to the CogServer on the next free session
+
+        :param str content: newline terminated scheme expressions
+        :param bool keep: resend the content if the session is lost before it is acknowledged
+        :return: 0 on success, non-zero on failure (same as netcat)
+        """
+
+        if not self.breaker.allow():
+            return 1
+
+        conn = self.idle.get()
+        try:
+            result = conn.send(content, keep)
+        finally:
+            self.idle.put(conn)
+
+        if result == 0:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return result
+
+    def retry_in(self):
+        """ Seconds until the circuit breaker lets the next send through
+
+        :return: float
+        """
+
+        return self.breaker.retry_in()
+
+    def rtt(self):
+        """ The slowest session's moving average of seconds from a payload being sent to being acknowledged
+
+        :return: float
+        """
+
+        return max(conn.rtt for conn in self.connections)
+
+    def eval_errors(self):
+        return sum(conn.eval_errors for conn in self.connections)
+
+    def pipeline_depth(self):
+        """ The fullest session's share of its pipeline waiting to be acknowledged
+
+        :return: float, from 0.0 to 1.0
+        """
+
+        return max(conn.pipeline_depth() for conn in self.connections)
+
+    def unacked_age(self):
+        """ Seconds the oldest payload not yet acknowledged on any session has been waiting
+
+        :return: float
+        """
+
+        now = time.time()
+        return max(conn.unacked_age(now) for conn in self.connections)
+
+    def stalls(self):
+        """ The number of sends that timed out waiting for room in a session's pipeline
+
+        :return: int
+        """
+
+        return sum(conn.stalls for conn in self.connections)
+
+    def is_healthy(self):
+        """ At least one session is open to the CogServer
+
+        :return: bool
+        """
+
+        return any(conn.is_connected() for conn in self.connections)
+
+    def health(self):
+        """ Report the state of every session in the pool
+
+        :return: dict
+        """
+
+        return {
+            "hostname": self.hostname,
+            "port": self.port,
+            "healthy": self.is_healthy(),
+            "circuit": self.breaker.state,
+            "connections": [conn.health() for conn in self.connections]
+        }
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
@@ -0,0 +1,40 @@
+#
+# constants.py - Values shared by the bridge and the action node.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# The name of each emotion, by its index in the emotions of a
+# ros_people_model Face message
+EMOTION_MAP = {
+    0: "anger",
+    1: "disgust",
+    2: "fear",
+    3: "happy",
+    4: "sad",
+    5: "surprise",
+    6: "neutral"
+}
+
+# The name of each eye, by its index in the eye states of a Face message
+EYE_MAP = {
+    0: "left",
+    1: "right"
+}
+
+# Seconds after which the per face state of a face no longer in view is
+# forgotten
+PERCEPTION_CACHE_MAX_AGE = 60.0
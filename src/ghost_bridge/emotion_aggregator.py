@@ -0,0 +1,107 @@
+#
+# emotion_aggregator.py - Smooth and summarize per face emotion vectors.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import time
+
+
+class FaceEmotions(object):
+    def __init__(self, confidences, now):
+        self.average = list(confidences)
+        self.dominant = None
+        self.last_emitted = None
+        self.last_updated = now
+
+
+class EmotionAggregator(object):
+    """
+        Keeps an exponential moving average of each face's emotion vector. Instead of the whole vector every frame,
+        Ghost is sent the top k smoothed emotions every interval seconds, plus a change event whenever the dominant
+        emotion flips.
+    """
+
+    def __init__(self, emotions, smoothing=0.3, top_k=2, interval=1.0):
+        """
+        :param list emotions: the emotion names, in the order of the confidences in the Face message
+        :param float smoothing: the weight given to the newest frame in the moving average, from 0.0 to 1.0
+        :param int top_k: the number of emotions sent each interval
+        :param float interval: seconds between the summaries sent for each face
+        """
+
+        self.emotions = emotions
+        self.smoothing = smoothing
+        self.top_k = top_k
+        self.interval = interval
+        self.faces = {}
+
+    def update(self, face_id, confidences, now=None):
+        """ Add a frame of emotion confidences for a face
+
+        :param str face_id: the id of the face
+        :param list confidences: the confidence of each emotion from 0.0 to 1.0
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: (top, dominant) where top is a list of (emotion_id, confidence) to send, empty if the face isn't due a
+                 summary, and dominant is the new dominant emotion_id if it has just changed, otherwise None
+        """
+
+        if now is None:
+            now = time.time()
+
+        face = self.faces.get(face_id)
+        if face is None:
+            face = self.faces[face_id] = FaceEmotions(confidences, now)
+        else:
+            a = self.smoothing
+            face.average = [a * c + (1.0 - a) * avg for c, avg in zip(confidences, face.average)]
+            face.last_updated = now
+
+        ranked = sorted(range(len(face.average)), key=lambda i: face.average[i], reverse=True)
+
+        dominant = None
+        if ranked and self.emotions[ranked[0]] != face.dominant:
+            face.dominant = dominant = self.emotions[ranked[0]]
+
+        top = []
+        if face.last_emitted is None or now - face.last_emitted >= self.interval:
+            top = [(self.emotions[i], face.average[i]) for i in ranked[:self.top_k]]
+            face.last_emitted = now
+
+        return top, dominant
+
+    def forget(self, face_id):
+        """ Forget a face, e.g. once it has been lost
+
+        :param str face_id: the id of the face
+        :return: None
+        """
+
+        self.faces.pop(face_id, None)
+
+    def prune(self, max_age, now=None):
+        """ Forget faces that haven't been updated for max_age seconds
+
+        :param float max_age: seconds
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if now is None:
+            now = time.time()
+
+        for face_id in [face_id for face_id, face in self.faces.items() if now - face.last_updated > max_age]:
+            del self.faces[face_id]
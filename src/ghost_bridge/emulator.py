@@ -0,0 +1,306 @@
+#
+# emulator.py - A stand-in CogServer for measuring the bridge without OpenCog.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import logging
+import random
+import socket
+import threading
+import time
+from collections import namedtuple
+from SocketServer import ThreadingTCPServer, BaseRequestHandler
+
+logger = logging.getLogger('ghost.emulator')
+
+
+# The emulator listens on a local port and speaks enough of the CogServer
+# shell protocol for the bridge: it reads newline terminated scheme
+# expressions, records each one with the time it arrived, and answers
+# with a prompt. Nothing is evaluated. It understands the pipelined
+# protocol of cogserver.CogServerConnection: the commands inside
+# ghost-bridge-try wrappers are recorded, and acknowledged or failed,
+# with the prompts in between, as the shell sends them.
+#
+# The ways a real CogServer is slow or unavailable can be dialled in:
+# evaluation latency and jitter per expression, slow reads that let the
+# socket back up, and refused connections.
+#
+# The emulator itself only uses the standard library, but it is imported
+# through the ghost_bridge package, whose __init__ imports every module,
+# so the package's ROS dependencies must be installed. No roscore or
+# OpenCog is needed:
+#
+#   emulator = CogServerEmulator(latency=0.001).start()
+#   ...send to localhost:emulator.port...
+#   emulator.wait_for(100)
+#   emulator.stop()
+
+Expression = namedtuple("Expression", ["time", "session", "procedure", "text"])
+
+# The forms of the pipelined protocol
+TRY = "(ghost-bridge-try "
+ACK = "(ghost-bridge-ack "
+DEFINE = "(define"
+
+
+class SchemeStreamParser(object):
+    """
+        Splits a stream of bytes into top level scheme expressions and shell commands. An expression may span lines
+        and reads, strings may hold parentheses. Anything outside of parentheses is a shell command, one per line.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, data):
+        """ Add bytes read from the socket
+
+        :param str data: the bytes
+        :return: list of the complete expressions and commands, in order
+        """
+
+        items = []
+        for c in data:
+            if self.in_string:
+                self.buffer.append(c)
+                if self.escaped:
+                    self.escaped = False
+                elif c == '\\':
+                    self.escaped = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '(':
+                if self.depth == 0 and self.buffer:
+                    self.command(items)
+                self.buffer.append(c)
+                self.depth += 1
+            elif c == ')' and self.depth > 0:
+                self.buffer.append(c)
+                self.depth -= 1
+                if self.depth == 0:
+                    items.append(''.join(self.buffer))
+                    self.buffer = []
+            elif c == '\n' and self.depth == 0:
+                self.command(items)
+            else:
+                if c == '"':
+                    self.in_string = True
+                self.buffer.append(c)
+        return items
+
+    def command(self, items):
+        command = ''.join(self.buffer).strip()
+        self.buffer = []
+        if command:
+            items.append(command)
+
+
+def procedure_name(text):
+    """ The name of the procedure a scheme expression calls, e.g. 'perceive-face'
+
+    :param str text: the expression
+    :return: str
+    """
+
+    end = len(text)
+    for c in (' ', ')', '\n'):
+        i = text.find(c, 1)
+        if 0 < i < end:
+            end = i
+    return text[1:end]
+
+
+class EmulatorHandler(BaseRequestHandler):
+    def handle(self):
+        emulator = self.server.emulator
+        session = emulator.open_session()
+        if session is None:
+            return
+
+        parser = SchemeStreamParser()
+        self.request.settimeout(None)
+        try:
+            while not emulator.stopped.is_set():
+                if emulator.read_delay > 0:
+                    time.sleep(emulator.read_delay)
+
+                data = self.request.recv(emulator.read_size)
+                if not data:
+                    break
+
+                replies = []
+                for item in parser.feed(data):
+                    if item.startswith(TRY):
+                        request_id, expression = item[len(TRY):-1].split(' ', 1)
+                        if not emulator.evaluate(session, expression):
+                            replies.append('ghost-bridge err {} emulated-error {} ()\n'.format(request_id, expression))
+                    elif item.startswith(ACK):
+                        replies.append('ghost-bridge ok {}\n'.format(item[len(ACK):-1]))
+                    elif item.startswith(DEFINE):
+                        pass
+                    elif item.startswith('('):
+                        emulator.evaluate(session, item)
+
+                    # Like the shell, prompt after every expression, without a newline
+                    if item.startswith('(') and emulator.prompt:
+                        replies.append(emulator.prompt)
+
+                if replies:
+                    self.request.sendall(''.join(replies))
+        except socket.error as e:
+            logger.debug("Session %d closed: %s", session, e)
+        finally:
+            emulator.close_session(session)
+
+
+class EmulatorServer(ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class CogServerEmulator(object):
+    """
+        A TCP server that records the scheme expressions sent to it, in place of the CogServer.
+    """
+
+    def __init__(self, hostname="localhost", port=0, latency=0.0, jitter=0.0, read_size=4096, read_delay=0.0,
+                 refuse=0, prompt="guile> ", fail=()):
+        """
+        :param str hostname: the address to listen on
+        :param int port: the port to listen on, 0 to pick a free one
+        :param float latency: seconds taken to evaluate each expression
+        :param float jitter: up to this many seconds are randomly added to or taken from the latency
+        :param int read_size: the most bytes read from a session at once, small values make slow readers
+        :param float read_delay: seconds slept before each read from a session
+        :param int refuse: the number of connections dropped straight after being accepted
+        :param str prompt: sent back after each expression, empty for none
+        :param fail: the names of the procedures whose evaluation fails, e.g. to test error reporting
+        """
+
+        self.latency = latency
+        self.jitter = jitter
+        self.read_size = read_size
+        self.read_delay = read_delay
+        self.refuse = refuse
+        self.prompt = prompt
+        self.fail = set(fail)
+
+        self.server = EmulatorServer((hostname, port), EmulatorHandler, bind_and_activate=True)
+        self.server.emulator = self
+        self.hostname, self.port = self.server.server_address
+
+        self.cond = threading.Condition()
+        self.stopped = threading.Event()
+        self.received = []
+        self.counts = {}
+        self.sessions = 0
+        self.open_sessions = 0
+        self.refused = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="cogserver_emulator")
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("CogServer emulator listening on %s:%d", self.hostname, self.port)
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+        with self.cond:
+            self.cond.notify_all()
+
+    def open_session(self):
+        """ Register a new connection
+
+        :return: the session number, or None if the connection is to be refused
+        """
+
+        with self.cond:
+            if self.refuse > 0:
+                self.refuse -= 1
+                self.refused += 1
+                return None
+            self.sessions += 1
+            self.open_sessions += 1
+            return self.sessions
+
+    def close_session(self, session):
+        with self.cond:
+            self.open_sessions -= 1
+
+    def evaluate(self, session, text):
+        """ Record an expression, after the emulated evaluation latency
+
+        :return: False if its evaluation fails
+        """
+
+        delay = self.latency
+        if self.jitter > 0:
+            delay += random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        expression = Expression(time.time(), session, procedure_name(text), text)
+        with self.cond:
+            self.received.append(expression)
+            self.counts[expression.procedure] = self.counts.get(expression.procedure, 0) + 1
+            self.cond.notify_all()
+        return expression.procedure not in self.fail
+
+    def wait_for(self, n, timeout=10.0):
+        """ Wait until n expressions have been received in total
+
+        :param int n: the number of expressions
+        :param float timeout: seconds
+        :return: True if they arrived in time
+        """
+
+        deadline = time.time() + timeout
+        with self.cond:
+            while len(self.received) < n and not self.stopped.is_set():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return len(self.received) >= n
+
+    def reset(self):
+        """ Forget what has been received so far
+
+        :return: None
+        """
+
+        with self.cond:
+            self.received = []
+            self.counts = {}
+
+    def stats(self):
+        with self.cond:
+            return {
+                "received": len(self.received),
+                "counts": dict(self.counts),
+                "sessions": self.sessions,
+                "open_sessions": self.open_sessions,
+                "refused": self.refused
+            }
@@ -0,0 +1,126 @@
+#
+# eye_events.py - Turn a face's eye states into blinks and closures.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import time
+
+# The events sent to Ghost
+BLINK = "blink"
+EYES_CLOSED = "eyes-closed"
+EYES_OPENED = "eyes-opened"
+
+
+class FaceEyes(object):
+    def __init__(self, now):
+        self.closed = False
+        self.closed_since = None
+        self.closed_reported = False
+        self.last_updated = now
+
+
+class EyeEventDetector(object):
+    """
+        Follows whether each face's eyes are open or closed, and reports the discrete events Ghost cares about instead
+        of the raw eye states of every frame:
+
+        blink        the eyes were closed for at most blink_max seconds
+        eyes-closed  the eyes have been closed for closed_min seconds
+        eyes-opened  the eyes have opened again after an eyes-closed event
+
+        The eyes count as closed once their mean state falls below closed_threshold, and as open again once it rises
+        above open_threshold, so a state hovering around one threshold doesn't flicker between the two.
+    """
+
+    def __init__(self, closed_threshold=0.3, open_threshold=0.5, blink_max=0.5, closed_min=1.5):
+        """
+        :param float closed_threshold: eye states below this count as closed, from 0.0 to 1.0
+        :param float open_threshold: eye states above this count as open, from 0.0 to 1.0
+        :param float blink_max: seconds, longer closures aren't blinks
+        :param float closed_min: seconds the eyes must be closed for before an eyes-closed event
+        """
+
+        self.closed_threshold = closed_threshold
+        self.open_threshold = open_threshold
+        self.blink_max = blink_max
+        self.closed_min = closed_min
+        self.faces = {}
+
+    def update(self, face_id, eye_states, now=None):
+        """ Add a frame of eye states for a face
+
+        :param str face_id: the id of the face
+        :param list eye_states: the state of each eye, from 0.0 closed to 1.0 open
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: list of (event, duration) where duration is the seconds the eyes were closed for
+        """
+
+        if now is None:
+            now = time.time()
+
+        face = self.faces.get(face_id)
+        if face is None:
+            face = self.faces[face_id] = FaceEyes(now)
+        face.last_updated = now
+
+        if len(eye_states) == 0:
+            return []
+        state = sum(eye_states) / float(len(eye_states))
+
+        events = []
+        if not face.closed:
+            if state < self.closed_threshold:
+                face.closed = True
+                face.closed_since = now
+                face.closed_reported = False
+        elif state > self.open_threshold:
+            duration = now - face.closed_since
+            if face.closed_reported:
+                events.append((EYES_OPENED, duration))
+            elif duration <= self.blink_max:
+                events.append((BLINK, duration))
+            face.closed = False
+            face.closed_since = None
+
+        if face.closed and not face.closed_reported and now - face.closed_since >= self.closed_min:
+            events.append((EYES_CLOSED, now - face.closed_since))
+            face.closed_reported = True
+
+        return events
+
+    def forget(self, face_id):
+        """ Forget a face, e.g. once it has been lost
+
+        :param str face_id: the id of the face
+        :return: None
+        """
+
+        self.faces.pop(face_id, None)
+
+    def prune(self, max_age, now=None):
+        """ Forget faces that haven't been updated for max_age seconds
+
+        :param float max_age: seconds
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if now is None:
+            now = time.time()
+
+        for face_id in [face_id for face_id, face in self.faces.items() if now - face.last_updated > max_age]:
+            del self.faces[face_id]
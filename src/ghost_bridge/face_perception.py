@@ -0,0 +1,224 @@
+#
+# face_perception.py - Turn Faces messages into perceptions for Ghost.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import threading
+import time
+
+import rospy
+from ghost_bridge.constants import EMOTION_MAP, EYE_MAP, PERCEPTION_CACHE_MAX_AGE
+from ghost_bridge.emotion_aggregator import EmotionAggregator
+from ghost_bridge.eye_events import EyeEventDetector
+from ghost_bridge.face_registry import FaceRegistry
+from ghost_bridge.face_selector import FaceSelector
+from ghost_bridge.perception_cache import PerceptionStateCache
+
+# The face perception pipeline, without the ROS node around it: which
+# faces are in view, which of them get full detail, and which of their
+# perceptions have changed enough to send. It has no params, subscribers,
+# services or timers of its own, so the ghost_bridge node can feed it the
+# Faces messages it forwards, and the action node can run it inside the
+# CogServer with an InProcessBackend.
+#
+# Blinks last a fraction of a second, far shorter than the period at
+# which Faces messages may be forwarded, so the eye event detector is run
+# on every Faces message received, by observe(), and only the events it
+# finds wait for the next perceive().
+
+
+class FacePerception(object):
+    """
+        Sends the perceptions of each Faces message to Ghost through a PerceptionCtrl, and tells Ghost when faces
+        appear and are lost. Call observe() with every Faces message received, perceive() with each one forwarded
+        and expire() about once a second.
+    """
+
+    def __init__(self, perception_ctrl, eye_events=True, pull_perceptions=False, face_lost_timeout=10.0,
+                 intern_face_ids=False, handles_cb=None):
+        """
+        :param ghost_bridge.perception_ctrl.PerceptionCtrl perception_ctrl: where the perceptions are sent
+        :param bool eye_events: send blinks and eye closures rather than the raw eye states of every frame
+        :param bool pull_perceptions: only push presence and dominant emotion changes, Ghost rules pull the rest
+                                      from the action node's perception store
+        :param float face_lost_timeout: seconds a face must be out of view for before it is lost
+        :param bool intern_face_ids: send faces' short handles instead of their ids
+        :param handles_cb: called with the face id of each handle whenever the handles change, if interning
+        """
+
+        self.perception_ctrl = perception_ctrl
+        self.eye_events = eye_events
+        self.pull_perceptions = pull_perceptions
+        self.handles_cb = handles_cb
+
+        # Only face perceptions that have changed, or are due a keep-alive, are forwarded to Ghost
+        self.perception_cache = PerceptionStateCache()
+        self.pruned = time.time()
+
+        # Emotions are smoothed per face and summarized, rather than sent raw every frame
+        self.emotion_aggregator = EmotionAggregator([name for i, name in sorted(EMOTION_MAP.items())])
+
+        # observe() runs on the subscriber's thread, perceive() and expire() on others
+        self.eye_lock = threading.Lock()
+        self.eye_event_detector = EyeEventDetector()
+        self.eye_events_pending = []  # (face_id, event, duration, stamp) found since the last perceive()
+
+        # Which faces are in view, and their handles
+        self.face_registry = FaceRegistry(lost_timeout=face_lost_timeout, interning=intern_face_ids)
+        self.publish_handles()
+
+        # Only the faces most deserving of attention are perceived in full detail
+        self.face_selector = FaceSelector()
+
+    def publish_handles(self):
+        if self.face_registry.interning and self.handles_cb is not None:
+            self.handles_cb(self.face_registry.handles())
+
+    def observe(self, faces, now=None):
+        """ Run the eye event detector over a Faces message, whether or not the message is forwarded
+
+        :param list faces: the ros_people_model.msg.Face messages
+        :param float now: when the faces were seen in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if not self.eye_events:
+            return
+        if now is None:
+            now = time.time()
+
+        with self.eye_lock:
+            for face in faces:
+                if len(face.eye_states) > 0:
+                    for event, duration in self.eye_event_detector.update(face.face_id, face.eye_states, now):
+                        self.eye_events_pending.append((face.face_id, event, duration, now))
+
+    def perceive(self, faces, now=None):
+        """ Send the perceptions of a Faces message
+
+        :param list faces: the ros_people_model.msg.Face messages
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if now is None:
+            now = time.time()
+        cache = self.perception_cache
+
+        detailed, heartbeat = self.face_selector.select(faces, now)
+        registry = self.face_registry
+        appeared = registry.update([face.face_id for face in faces], now)
+        if appeared:
+            self.publish_handles()
+
+        with self.eye_lock:
+            eye_events, self.eye_events_pending = self.eye_events_pending, []
+
+        # All of the perceptions for one Faces message go to the CogServer as one payload, and in bulk mode as one
+        # perceive-frame call
+        with self.perception_ctrl.frame():
+            for face_id in appeared:
+                self.perception_ctrl.perceive_face_appeared(registry.handle(face_id))
+
+            # The eye events of every face, not just those in the budget, as they are found at most once each
+            for face_id, event, duration, stamp in eye_events:
+                if registry.is_present(face_id):
+                    self.perception_ctrl.perceive_eye_event(registry.handle(face_id), event, duration, stamp)
+
+            # Faces outside of the budget only get a presence heartbeat
+            for face in heartbeat:
+                self.perception_ctrl.perceive_face(registry.handle(face.face_id), face.position.x, face.position.y,
+                                                   face.position.z, face.certainty)
+
+            for face in detailed:
+                handle = registry.handle(face.face_id)
+                if cache.should_send(face.face_id, "face", face.certainty, now):
+                    self.perception_ctrl.perceive_face(handle, face.position.x, face.position.y,
+                                                       face.position.z, face.certainty)
+
+                if len(face.eye_states) > 0 and not self.eye_events and not self.pull_perceptions:
+                    for i, state in enumerate(face.eye_states):
+                        eye_id = EYE_MAP[i]
+                        if cache.should_send(face.face_id, "eye:" + eye_id, state, now):
+                            self.perception_ctrl.perceive_eye_state(handle, eye_id, state)
+
+                if len(face.emotions) > 0:
+                    top, dominant = self.emotion_aggregator.update(face.face_id, face.emotions, now)
+                    if dominant is not None:
+                        self.perception_ctrl.perceive_dominant_emotion(handle, dominant)
+
+                    for emotion_id, confidence in top:
+                        if not self.pull_perceptions and \
+                                cache.should_send(face.face_id, "emotion:" + emotion_id, confidence, now):
+                            self.perception_ctrl.perceive_emotion(handle, emotion_id, confidence)
+
+        # Forget the faces that have left the view
+        if now - self.pruned > PERCEPTION_CACHE_MAX_AGE:
+            self.prune(PERCEPTION_CACHE_MAX_AGE, now)
+
+    def expire(self, now=None):
+        """ Tell Ghost about the faces that have been out of view for longer than the face lost timeout
+
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: list of (face_id, handle) for the faces that have just been lost
+        """
+
+        lost = self.face_registry.expire(now)
+        if not lost:
+            return lost
+
+        with self.perception_ctrl.batch():
+            for face_id, handle in lost:
+                self.perception_ctrl.perceive_face_lost(handle)
+                self.perception_cache.forget(face_id)
+                self.emotion_aggregator.forget(face_id)
+                with self.eye_lock:
+                    self.eye_event_detector.forget(face_id)
+                self.face_selector.forget(face_id)
+                rospy.logdebug("Face lost: {} ({})".format(face_id, handle))
+        self.publish_handles()
+        return lost
+
+    def mark_interaction(self, face_id):
+        """ Record that the robot interacted with a face, e.g. looked at it
+
+        :param str face_id: the id or handle of the face
+        :return: None
+        """
+
+        self.face_selector.mark_interaction(self.face_registry.resolve(face_id))
+
+    def prune(self, max_age, now=None):
+        """ Forget the state of the faces that haven't been seen for max_age seconds
+
+        :param float max_age: seconds
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if now is None:
+            now = time.time()
+
+        self.perception_cache.prune(max_age, now)
+        self.emotion_aggregator.prune(max_age, now)
+        with self.eye_lock:
+            self.eye_event_detector.prune(max_age, now)
+        self.face_selector.prune(max_age, now)
+        self.pruned = now
+
+    def stats(self):
+        return self.face_registry.stats()
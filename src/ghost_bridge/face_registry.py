@@ -0,0 +1,202 @@
+#
+# face_registry.py - Track which faces are in view, and their short handles.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import threading
+import time
+
+import rospy
+
+# Face ids are long hex strings, repeated in every perception. With
+# interning on, each face is given a short handle, e.g. 'f1a', when it
+# appears, and Ghost only ever sees the handle. The table of handles is
+# published as a rosparam, so the nodes that take face ids back from
+# Ghost, e.g. the face tracker, can resolve them. The param's name is
+# absolute, so it doesn't depend on which node publishes it, and each node
+# can be pointed at another with its ~face_handles_param param.
+
+FACE_HANDLES_PARAM = "/ghost_bridge/face_handles"
+HANDLE_PREFIX = "f"
+HANDLE_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+class FaceRecord(object):
+    def __init__(self, handle, now):
+        self.handle = handle
+        self.first_seen = now
+        self.last_seen = now
+
+
+class FaceRegistry(object):
+    """
+        Tracks when each face was first and last seen. A face appears the first time it is seen, and is lost once it
+        hasn't been seen for lost_timeout seconds, when its handle is retired. Safe to call from any thread.
+    """
+
+    def __init__(self, lost_timeout=10.0, interning=False):
+        """
+        :param float lost_timeout: seconds a face must be out of view for before it is lost
+        :param bool interning: give faces short handles to use on the wire instead of their ids
+        """
+
+        self.lost_timeout = lost_timeout
+        self.interning = interning
+        self.lock = threading.Lock()
+        self.faces = {}  # face_id -> FaceRecord
+        self.face_ids = {}  # handle -> face_id
+        self.next_handle = 0
+
+        self.appeared = 0
+        self.lost = 0
+
+    def update(self, face_ids, now=None):
+        """ Mark faces as seen
+
+        :param list face_ids: the ids of the faces in view
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: list of the face_ids that have just appeared
+        """
+
+        if now is None:
+            now = time.time()
+
+        appeared = []
+        with self.lock:
+            for face_id in face_ids:
+                record = self.faces.get(face_id)
+                if record is None:
+                    handle = self._intern(face_id)
+                    self.faces[face_id] = FaceRecord(handle, now)
+                    appeared.append(face_id)
+                else:
+                    record.last_seen = now
+            self.appeared += len(appeared)
+        return appeared
+
+    def expire(self, now=None):
+        """ Lose the faces that haven't been seen for lost_timeout seconds
+
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: list of (face_id, handle) for the faces that have just been lost
+        """
+
+        if now is None:
+            now = time.time()
+
+        lost = []
+        with self.lock:
+            for face_id, record in list(self.faces.items()):
+                if now - record.last_seen > self.lost_timeout:
+                    del self.faces[face_id]
+                    self.face_ids.pop(record.handle, None)
+                    lost.append((face_id, record.handle))
+            self.lost += len(lost)
+        return lost
+
+    def handle(self, face_id):
+        """ The id to send Ghost for a face
+
+        :param str face_id: the id of the face
+        :return: str, its handle if interning and the face is registered, otherwise the id itself
+        """
+
+        record = self.faces.get(face_id)
+        if record is None:
+            return face_id
+        return record.handle
+
+    def resolve(self, handle):
+        """ The id of the face a handle, e.g. one sent back by Ghost, stands for
+
+        :param str handle: the handle
+        :return: str, the face id, or handle itself if it isn't one
+        """
+
+        return self.face_ids.get(handle, handle)
+
+    def handles(self):
+        """ The face id of each live handle
+
+        :return: dict
+        """
+
+        with self.lock:
+            return dict(self.face_ids)
+
+    def is_present(self, face_id):
+        return face_id in self.faces
+
+    def stats(self):
+        with self.lock:
+            return {
+                "present": len(self.faces),
+                "appeared": self.appeared,
+                "lost": self.lost
+            }
+
+    def _intern(self, face_id):
+        if not self.interning or not face_id:
+            return face_id
+
+        n = self.next_handle
+        self.next_handle += 1
+        digits = []
+        while True:
+            n, digit = divmod(n, len(HANDLE_DIGITS))
+            digits.append(HANDLE_DIGITS[digit])
+            if n == 0:
+                break
+        handle = HANDLE_PREFIX + "".join(reversed(digits))
+        self.face_ids[handle] = face_id
+        return handle
+
+
+class FaceHandleResolver(object):
+    """
+        Resolves the face handles Ghost uses back to face ids, from the table the bridge publishes as a rosparam. The
+        table is only fetched again when an unknown handle turns up, at most every refresh_interval seconds.
+    """
+
+    def __init__(self, param=FACE_HANDLES_PARAM, refresh_interval=1.0):
+        """
+        :param str param: the rosparam the bridge publishes the handle table to
+        :param float refresh_interval: the least seconds between fetches of the table
+        """
+
+        self.param = param
+        self.refresh_interval = refresh_interval
+        self.face_ids = {}
+        self.refreshed = 0.0
+
+    def resolve(self, handle):
+        """ The face id a handle stands for
+
+        :param str handle: the handle, or a face id
+        :return: str, the face id, or handle itself if it isn't one
+        """
+
+        face_id = self.face_ids.get(handle)
+        if face_id is None and handle.startswith(HANDLE_PREFIX) and \
+                time.time() - self.refreshed >= self.refresh_interval:
+            self.refreshed = time.time()
+            try:
+                self.face_ids = rospy.get_param(self.param, {})
+            except Exception as e:
+                rospy.logwarn_throttle(5.0, "Couldn't fetch the face handles from {}: {}".format(self.param, e))
+            face_id = self.face_ids.get(handle)
+        return face_id if face_id is not None else handle
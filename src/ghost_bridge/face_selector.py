@@ -0,0 +1,145 @@
+#
+# face_selector.py - Choose which faces get full perception detail.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import heapq
+import math
+import time
+
+
+class FaceSelector(object):
+    """
+        Ranks the faces in a frame by how much attention they deserve, so that only a bounded number of them are
+        perceived in full detail. The rest only get a low rate presence heartbeat, and at most max_heartbeats of them
+        per frame, taking turns by whose heartbeat is most overdue, so a crowd's heartbeats are spread out rather than
+        all falling due in the same frame.
+    """
+
+    # Weights of each term of the attention score
+    CERTAINTY_WEIGHT = 1.0
+    PROXIMITY_WEIGHT = 1.0
+    INTERACTION_WEIGHT = 1.5
+
+    # Seconds for the interaction term to decay to 1/e
+    INTERACTION_DECAY = 10.0
+
+    def __init__(self, budget=3, heartbeat_interval=5.0, max_heartbeats=4):
+        """
+        :param int budget: the number of faces perceived in full detail each frame, 0 for no limit
+        :param float heartbeat_interval: seconds between the presence heartbeats of the other faces
+        :param int max_heartbeats: the most presence heartbeats sent each frame, 0 for no limit
+        """
+
+        self.budget = budget
+        self.heartbeat_interval = heartbeat_interval
+        self.max_heartbeats = max_heartbeats
+        self.last_interaction = {}  # face_id -> time
+        self.last_heartbeat = {}  # face_id -> time
+
+    def mark_interaction(self, face_id, now=None):
+        """ Record that the robot interacted with a face, e.g. looked at it
+
+        :param str face_id: the id of the face
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if now is None:
+            now = time.time()
+        self.last_interaction[face_id] = now
+
+    def score(self, face, now):
+        """ The attention score of a face, higher is more deserving
+
+        :param ros_people_model.msg.Face face: the face
+        :param float now: the current time in seconds
+        :return: float
+        """
+
+        p = face.position
+        proximity = 1.0 / (1.0 + math.sqrt(p.x * p.x + p.y * p.y + p.z * p.z))
+
+        interaction = 0.0
+        last = self.last_interaction.get(face.face_id)
+        if last is not None:
+            interaction = math.exp(-(now - last) / FaceSelector.INTERACTION_DECAY)
+
+        return FaceSelector.CERTAINTY_WEIGHT * face.certainty + FaceSelector.PROXIMITY_WEIGHT * proximity + \
+            FaceSelector.INTERACTION_WEIGHT * interaction
+
+    def select(self, faces, now=None):
+        """ Split the faces of a frame into those perceived in full detail and those due a presence heartbeat
+
+        :param list faces: the ros_people_model.msg.Face messages of the frame
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: (detailed, heartbeat) lists of faces
+        """
+
+        if now is None:
+            now = time.time()
+
+        if self.budget <= 0 or len(faces) <= self.budget:
+            return list(faces), []
+
+        detailed = heapq.nlargest(self.budget, faces, key=lambda face: self.score(face, now))
+        detailed_ids = set(face.face_id for face in detailed)
+
+        # The faces due a heartbeat, most overdue first. Faces that have never had one go first.
+        due = []
+        for face in faces:
+            if face.face_id in detailed_ids:
+                continue
+
+            last = self.last_heartbeat.get(face.face_id)
+            if last is None or now - last >= self.heartbeat_interval:
+                due.append((-float("inf") if last is None else last, face))
+
+        if self.max_heartbeats > 0 and len(due) > self.max_heartbeats:
+            due = heapq.nsmallest(self.max_heartbeats, due, key=lambda item: item[0])
+
+        heartbeat = []
+        for last, face in due:
+            self.last_heartbeat[face.face_id] = now
+            heartbeat.append(face)
+
+        return detailed, heartbeat
+
+    def forget(self, face_id):
+        """ Forget a face, e.g. once it has been lost
+
+        :param str face_id: the id of the face
+        :return: None
+        """
+
+        self.last_interaction.pop(face_id, None)
+        self.last_heartbeat.pop(face_id, None)
+
+    def prune(self, max_age, now=None):
+        """ Forget faces that haven't been seen for max_age seconds
+
+        :param float max_age: seconds
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if now is None:
+            now = time.time()
+
+        for table in (self.last_interaction, self.last_heartbeat):
+            for face_id in [face_id for face_id, t in table.items() if now - t > max_age]:
+                del table[face_id]
@@ -0,0 +1,208 @@
+#
+# face_table.py - The position of every face in view, for the face tracker.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import threading
+import time
+
+import numpy as np
+
+
+class FacePositionTable(object):
+    """
+        One row per face frame: its position in the robot's frame and when that was measured. The rows of the faces
+        whose transforms have changed are updated together, and lookups, e.g. the face nearest to where the robot is
+        looking, are array operations over the whole table. Safe to call from any thread.
+    """
+
+    def __init__(self, capacity=16):
+        """
+        :param int capacity: the number of rows to start with, the table doubles when it fills up
+        """
+
+        self.lock = threading.Lock()
+        self.rows = {}  # frame -> row
+        self.frames = [None] * capacity
+        self.positions = np.full((capacity, 3), np.nan)
+        self.stamps = np.full(capacity, np.nan)
+        self.seen = np.full(capacity, -np.inf)  # when each face was last listed in a Faces message
+        self.pending = set()  # the frames whose transforms have changed since the last update
+
+    def sync(self, frames, now=None):
+        """ Add the faces in a Faces message, and mark them as seen
+
+        :param list frames: the tf frame of each face, i.e. its face id
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            for frame in frames:
+                row = self.rows.get(frame)
+                if row is None:
+                    row = self._add(frame)
+                    self.pending.add(frame)
+                self.seen[row] = now
+
+    def track(self, frame):
+        """ Make sure a frame has a row, e.g. the target of a goal that isn't a face
+
+        :param str frame: the tf frame
+        :return: None
+        """
+
+        with self.lock:
+            if frame not in self.rows:
+                self._add(frame)
+            self.pending.add(frame)
+
+    def changed(self, frame):
+        """ Note that a frame's transform has changed
+
+        :param str frame: the tf frame
+        :return: True if the frame is in the table
+        """
+
+        with self.lock:
+            if frame in self.rows:
+                self.pending.add(frame)
+                return True
+            return False
+
+    def take_pending(self):
+        """ The frames whose transforms have changed since the last call
+
+        :return: list of str
+        """
+
+        with self.lock:
+            pending = list(self.pending)
+            self.pending.clear()
+            return pending
+
+    def update(self, frames, positions, stamps):
+        """ Set the positions of several faces at once
+
+        :param list frames: the tf frames
+        :param list positions: (x, y, z) in metres for each frame
+        :param list stamps: when each position was measured, in seconds
+        :return: None
+        """
+
+        if not frames:
+            return
+
+        with self.lock:
+            known = [(i, self.rows[frame]) for i, frame in enumerate(frames) if frame in self.rows]
+            if not known:
+                return
+            src, dst = zip(*known)
+            self.positions[list(dst)] = np.asarray(positions, dtype=np.float64)[list(src)]
+            self.stamps[list(dst)] = np.asarray(stamps, dtype=np.float64)[list(src)]
+
+    def position(self, frame):
+        """ The last known position of a frame
+
+        :param str frame: the tf frame
+        :return: ([x, y, z], stamp), or None if its position isn't known
+        """
+
+        with self.lock:
+            row = self.rows.get(frame)
+            if row is None or np.isnan(self.stamps[row]):
+                return None
+            return self.positions[row].tolist(), float(self.stamps[row])
+
+    def nearest(self, direction=None, exclude=()):
+        """ The face nearest to the robot, or with direction given, the one closest to that direction
+
+        :param direction: (x, y, z), e.g. where the robot is looking
+        :param exclude: frames to leave out
+        :return: str, the frame of the face, or None if no face positions are known
+        """
+
+        with self.lock:
+            rows = [row for frame, row in self.rows.items() if frame not in exclude]
+            if not rows:
+                return None
+            rows = np.asarray(rows)
+            positions = self.positions[rows]
+            valid = ~np.isnan(self.stamps[rows])
+            if not np.any(valid):
+                return None
+            rows = rows[valid]
+            positions = positions[valid]
+
+            distances = np.linalg.norm(positions, axis=1)
+            if direction is None:
+                best = np.argmin(distances)
+            else:
+                direction = np.asarray(direction, dtype=np.float64)
+                norm = np.linalg.norm(direction)
+                if norm == 0:
+                    best = np.argmin(distances)
+                else:
+                    # The largest cosine is the smallest angle
+                    cosines = positions.dot(direction / norm) / np.maximum(distances, 1e-9)
+                    best = np.argmax(cosines)
+            return self.frames[rows[best]]
+
+    def expire(self, max_age, keep=(), now=None):
+        """ Remove the faces that haven't been in a Faces message for max_age seconds
+
+        :param float max_age: seconds
+        :param keep: frames to keep regardless, e.g. the current target
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: list of the frames removed
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            removed = [frame for frame, row in self.rows.items()
+                       if frame not in keep and now - self.seen[row] > max_age]
+            for frame in removed:
+                row = self.rows.pop(frame)
+                self.frames[row] = None
+                self.positions[row] = np.nan
+                self.stamps[row] = np.nan
+                self.seen[row] = -np.inf
+                self.pending.discard(frame)
+            return removed
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _add(self, frame):
+        try:
+            row = self.frames.index(None)
+        except ValueError:
+            # Full, double the table
+            row = len(self.frames)
+            self.frames.extend([None] * row)
+            self.positions = np.vstack([self.positions, np.full((row, 3), np.nan)])
+            self.stamps = np.concatenate([self.stamps, np.full(row, np.nan)])
+            self.seen = np.concatenate([self.seen, np.full(row, -np.inf)])
+
+        self.frames[row] = frame
+        self.rows[frame] = row
+        return row
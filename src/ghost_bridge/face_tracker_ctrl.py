@@ -1,17 +1,158 @@
-import tf
+import threading
+import time
+
+import tf2_ros
 import rospy
 import math
 from blender_api_msgs.msg import Target
-from ghost_bridge.msg import GazeAction, GazeActionFeedback
+from diagnostic_msgs.msg import DiagnosticArray
+from ghost_bridge.face_registry import FaceHandleResolver, FACE_HANDLES_PARAM
+from ghost_bridge.face_table import FacePositionTable
+from ghost_bridge.metrics import Metrics
+from ghost_bridge.motion_model import ConstantVelocityModel
+from ghost_bridge.msg import GazeAction, GazeFeedback, GazeRetarget
 from actionlib import SimpleActionServer
+from ros_people_model.msg import Faces
+from tf2_msgs.msg import TFMessage
 
 
-class FaceTracker(object):
-    DIST_THRESH = 0.0
+# Faces are tracked from the tf messages that move their frames, rather
+# than by polling tf. The tracker fills its own tf2 buffer from /tf, and
+# keeps a table of the position of every face listed on /faces. When a
+# message moves face frames, their positions are looked up once in the
+# buffer and written to the table together. Goals, and 'nearest' goals
+# for the face closest to the robot, start from the table.
+#
+# The position of the face being looked at is fed to a constant velocity
+# model, and the target the model predicts is published at ~publish_rate,
+# so the eyes and head follow a moving person smoothly between the
+# perception frames.
+#
+# A new goal takes over from the running one as soon as it arrives, and the
+# eyes go straight from the old face to the new one. Only a cancel without
+# a new goal returns them to the default position. A running goal can also
+# be pointed at another face, without replacing it, by publishing a
+# GazeRetarget message on /gaze_action/retarget. The feedback of a goal
+# reports how long the last switch took, from the stamp of the goal or
+# retarget, i.e. when it was sent, to the first target for it being
+# published.
+
+# The goal target for the face closest to the robot
+NEAREST = "nearest"
+
+
+class GazeOutputStage(object):
+    """
+        Decides which gaze targets are worth sending to the eyes and the head. A target is only sent to the eyes once
+        it is more than eye_deadband radians from the last one they were sent, and at most eye_max_rate times a
+        second. The head needs a larger change, head_deadband, sustained for head_sustain seconds, and is sent at most
+        head_max_rate times a second, so it only follows real movement and not the jitter of face detection.
+    """
+
+    def __init__(self, eye_deadband=math.radians(1.0), head_deadband=math.radians(5.0), eye_max_rate=10.0,
+                 head_max_rate=2.0, head_sustain=0.3):
+        """
+        :param float eye_deadband: radians
+        :param float head_deadband: radians
+        :param float eye_max_rate: Hz
+        :param float head_max_rate: Hz
+        :param float head_sustain: seconds a change must last for before the head follows it
+        """
+
+        self.eye_deadband = eye_deadband
+        self.head_deadband = head_deadband
+        self.eye_max_rate = eye_max_rate
+        self.head_max_rate = head_max_rate
+        self.head_sustain = head_sustain
+
+        self.eye_target = None  # (yaw, pitch) last sent to the eyes
+        self.eye_sent = 0.0
+        self.head_target = None
+        self.head_sent = 0.0
+        self.head_pending_since = None
+
+        self.eye_published = 0
+        self.eye_suppressed = 0
+        self.head_published = 0
+        self.head_suppressed = 0
+
+    def update(self, position, now=None, force=False):
+        """ Decide whether to send a target to the eyes and the head
+
+        :param position: (x, y, z) in metres, in the blender frame
+        :param float now: the current time in seconds, defaults to time.time()
+        :param bool force: send to both, e.g. for a new goal or the default position
+        :return: (eyes, head), whether to send the target to each
+        """
+
+        if now is None:
+            now = time.time()
+
+        angles = GazeOutputStage.angles(position)
+        eyes = force or self.eye_target is None or \
+            (GazeOutputStage.separation(angles, self.eye_target) > self.eye_deadband and
+             now - self.eye_sent >= 1.0 / self.eye_max_rate)
+
+        head = force or self.head_target is None
+        if not head:
+            if GazeOutputStage.separation(angles, self.head_target) <= self.head_deadband:
+                self.head_pending_since = None
+            elif self.head_pending_since is None:
+                self.head_pending_since = now
+            else:
+                head = now - self.head_pending_since >= self.head_sustain and \
+                    now - self.head_sent >= 1.0 / self.head_max_rate
 
+        if eyes:
+            self.eye_target = angles
+            self.eye_sent = now
+            self.eye_published += 1
+        else:
+            self.eye_suppressed += 1
+
+        if head:
+            self.head_target = angles
+            self.head_sent = now
+            self.head_pending_since = None
+            self.head_published += 1
+        else:
+            self.head_suppressed += 1
+
+        return eyes, head
+
+    def stats(self):
+        return {
+            "eye_published": self.eye_published,
+            "eye_suppressed": self.eye_suppressed,
+            "head_published": self.head_published,
+            "head_suppressed": self.head_suppressed
+        }
+
+    @staticmethod
+    def angles(position):
+        """ The yaw and pitch of a point seen from the robot
+
+        :param position: (x, y, z) in metres, x forward, y to the robot's left and z up
+        :return: (yaw, pitch) in radians
+        """
+
+        x, y, z = position[0], position[1], position[2]
+        return math.atan2(y, x), math.atan2(z, math.sqrt(x * x + y * y))
+
+    @staticmethod
+    def separation(a, b):
+        """ The angle between two (yaw, pitch) directions, small angle approximation
+
+        :return: radians
+        """
+
+        yaw = math.atan2(math.sin(a[0] - b[0]), math.cos(a[0] - b[0]))
+        return math.sqrt(yaw * yaw + (a[1] - b[1]) * (a[1] - b[1]))
+
+
+class FaceTracker(object):
     def __init__(self):
-        self.rate = rospy.Rate(2)
-        self.tf = tf.TransformListener()
+        self.tf_buffer = tf2_ros.Buffer()
         self.eye_speed = 0.2
         self.head_speed = 0.7
 
@@ -19,48 +160,217 @@ class FaceTracker(object):
         self.default_position = [1, 0, 0]  # Looking straight ahead 1 metre
         self.last_position = None
 
+        # Ghost may refer to faces by the short handles the bridge gives them
+        self.face_handles = FaceHandleResolver(rospy.get_param("~face_handles_param", FACE_HANDLES_PARAM))
+
+        # The face being tracked, and the model predicting where it is
+        self.lock = threading.Lock()
+        self.target_frame = None
+        self.switch_stamp = None  # when the switch to the current target was sent, until its first target is out
+        self.switch_latency = 0.0
+        self.model = ConstantVelocityModel(max_prediction=rospy.get_param("~max_prediction", 0.5))
+
+        # The position of every face in view
+        self.table = FacePositionTable()
+        self.face_timeout = rospy.get_param("~face_timeout", 5.0)
+        self.table_expired = time.time()
+
+        self.feedback_interval = 0.5
+        self.feedback_sent = 0.0
+
+        # Only targets that have moved enough are sent to the eyes, and the head only follows sustained moves
+        self.output = GazeOutputStage(eye_deadband=math.radians(rospy.get_param("~eye_deadband", 1.0)),
+                                      head_deadband=math.radians(rospy.get_param("~head_deadband", 5.0)),
+                                      eye_max_rate=rospy.get_param("~eye_max_rate", 10.0),
+                                      head_max_rate=rospy.get_param("~head_max_rate", 2.0),
+                                      head_sustain=rospy.get_param("~head_sustain", 0.3))
+
+        # Latency from a gaze goal being sent to the first target it produces being published
+        self.metrics = Metrics()
+        self.diagnostics_pub = rospy.Publisher("/diagnostics", DiagnosticArray, queue_size=1)
+        rospy.Timer(rospy.Duration(5.0), self.diagnostics_cb)
+
         # Publishers for making the face and eyes look at a point
         self.face_target_pub = rospy.Publisher("/blender_api/set_face_target", Target, queue_size=1)
         self.gaze_target_pub = rospy.Publisher("/blender_api/set_gaze_target", Target, queue_size=1)
 
-        # Gaze action server
-        self.action_srv = SimpleActionServer("/gaze_action", GazeAction, execute_cb=self.execute_cb, auto_start=False)
+        # Follow the tf messages that move the target frame, and publish the predicted target in between them
+        rospy.Subscriber("/tf", TFMessage, self.tf_cb, queue_size=100)
+        rospy.Subscriber("/tf_static", TFMessage, self.tf_static_cb, queue_size=100)
+        rospy.Subscriber("/faces", Faces, self.faces_cb, queue_size=1)
+        rospy.Timer(rospy.Duration(1.0 / rospy.get_param("~publish_rate", 10.0)), self.publish_cb)
+
+        # Gaze action server, whose goals are switched from its callbacks rather than polled for preemption
+        self.action_srv = SimpleActionServer("/gaze_action", GazeAction, auto_start=False)
+        self.action_srv.register_goal_callback(self.goal_cb)
+        self.action_srv.register_preempt_callback(self.preempt_cb)
         self.action_srv.start()
+        rospy.Subscriber("/gaze_action/retarget", GazeRetarget, self.retarget_cb, queue_size=1)
 
-    def execute_cb(self, goal):
+    def goal_cb(self):
+        # Accepting the new goal preempts the running one, which hands its target straight over
+        goal = self.action_srv.accept_new_goal()
         rospy.loginfo("Target goal received: " + str(goal))
-        target_frame = goal.target
 
-        while not rospy.is_shutdown() and not self.action_srv.is_preempt_requested() and self.action_srv.is_active():
-            if self.tf.frameExists(target_frame) and self.tf.frameExists(self.blender_frame):
-                time = self.tf.getLatestCommonTime(target_frame, self.blender_frame)
-                position, quaternion = self.tf.lookupTransform(self.blender_frame, target_frame, time)
-                update_target = self.last_position is None
+        stamp = self.action_srv.current_goal.get_goal_id().stamp
+        if not self.set_target(goal.target, None if stamp.is_zero() else stamp.to_sec()):
+            self.action_srv.set_aborted()
+            self.look_ahead()
 
-                if self.last_position is not None:
-                    dist = FaceTracker.distance(position, self.last_position)
-                    update_target = dist > FaceTracker.DIST_THRESH
+    def preempt_cb(self):
+        # A new goal preempts the running one too, in which case goal_cb takes over
+        if self.action_srv.is_new_goal_available():
+            return
 
-                if update_target:
-                    self.gaze_at_point(position)
+        self.action_srv.set_preempted()
+        self.look_ahead()
 
-            self.action_srv.publish_feedback(GazeActionFeedback())
-            self.rate.sleep()
+    def retarget_cb(self, msg):
+        if not self.action_srv.is_active():
+            rospy.logwarn("Can't retarget to {}, there is no gaze goal running".format(msg.target))
+            return
 
-        # If gaze has been cancelled then set default position
-        self.gaze_at_point(self.default_position)
+        rospy.loginfo("Target goal updated: " + msg.target)
+        stamp = msg.stamp.to_sec() if not msg.stamp.is_zero() else None
+        if not self.set_target(msg.target, stamp):
+            self.action_srv.set_aborted()
+            self.look_ahead()
 
-    @staticmethod
-    def distance(p1, p2):
-        return math.sqrt(math.pow(p1[0] - p2[0], 2) + math.pow(p1[1] - p2[1], 2) + math.pow(p1[2] - p2[2], 2))
+    def set_target(self, target, stamp):
+        """ Start following a face
+
+        :param str target: the tf frame of the face, its handle, or 'nearest'
+        :param float stamp: when the switch to it was sent in seconds, defaults to now
+        :return: False if there is no face to follow
+        """
+
+        if target == NEAREST:
+            target_frame = self.table.nearest()
+            if target_frame is None:
+                rospy.logwarn("No faces to look at")
+                return False
+        else:
+            target_frame = self.face_handles.resolve(target).lstrip('/')
+        self.table.track(target_frame)
+
+        with self.lock:
+            self.target_frame = target_frame
+            self.switch_stamp = stamp if stamp is not None else rospy.get_time()
+            self.model.reset()
+
+            # Start from where the face was last seen, rather than waiting for its frame to move
+            known = self.table.position(target_frame)
+            if known is not None:
+                self.model.update(*known)
+        self.update_table()
+        return True
+
+    def look_ahead(self):
+        with self.lock:
+            self.target_frame = None
+            self.switch_stamp = None
+            self.model.reset()
+
+        self.gaze_at_point(self.default_position, force=True)
+
+    def faces_cb(self, msg):
+        now = time.time()
+        self.table.sync([face.face_id for face in msg.faces], now)
+
+        if now - self.table_expired > self.face_timeout:
+            self.table.expire(self.face_timeout, keep=(self.target_frame,), now=now)
+            self.table_expired = now
+
+    def tf_cb(self, msg):
+        changed = False
+        for transform in msg.transforms:
+            self.tf_buffer.set_transform(transform, "face_tracker")
+            changed = self.table.changed(transform.child_frame_id.lstrip('/')) or changed
+
+        if changed:
+            self.update_table()
+
+    def tf_static_cb(self, msg):
+        for transform in msg.transforms:
+            self.tf_buffer.set_transform_static(transform, "face_tracker")
+
+    def update_table(self):
+        """ Look up the faces whose frames have moved in the tf buffer, write them to the table in one go, and add
+        the target to the motion model
+
+        :return: None
+        """
+
+        frames = []
+        positions = []
+        stamps = []
+        for frame in self.table.take_pending():
+            try:
+                transform = self.tf_buffer.lookup_transform(self.blender_frame, frame, rospy.Time(0))
+            except (tf2_ros.LookupException, tf2_ros.ConnectivityException, tf2_ros.ExtrapolationException) as e:
+                rospy.logdebug("No transform to {}: {}".format(frame, e))
+                continue
+            t = transform.transform.translation
+            frames.append(frame)
+            positions.append((t.x, t.y, t.z))
+            stamps.append(transform.header.stamp.to_sec())
+        self.table.update(frames, positions, stamps)
+
+        with self.lock:
+            if self.target_frame in frames:
+                i = frames.index(self.target_frame)
+                self.model.update(positions[i], stamps[i])
+
+    def publish_cb(self, event):
+        now = rospy.get_time()
+        with self.lock:
+            if self.target_frame is None or not self.model.is_initialized():
+                return
+            target_frame = self.target_frame
+            position = self.model.predict(now)
+            switch_stamp = self.switch_stamp
+            self.switch_stamp = None
+
+        # The first target after a switch is always sent
+        self.gaze_at_point(position, force=switch_stamp is not None)
+
+        if switch_stamp is not None:
+            self.switch_latency = max(0.0, now - switch_stamp)
+            self.metrics.observe("trace.gaze.gaze_goal->target_published", self.switch_latency)
+
+        if switch_stamp is not None or now - self.feedback_sent >= self.feedback_interval:
+            if self.action_srv.is_active():
+                self.action_srv.publish_feedback(GazeFeedback(target=target_frame,
+                                                              switch_latency=self.switch_latency))
+            self.feedback_sent = now
+
+    def diagnostics_cb(self, event):
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        status = self.metrics.diagnostic_status("ghost_bridge: face tracker",
+                                                extra=self.output.stats())
+        status.hardware_id = "face_tracker"
+        msg.status = [status]
+        self.diagnostics_pub.publish(msg)
+
+    def gaze_at_point(self, position, force=False):
+        """ Turn the robot's eyes, and the head if the move is big enough, towards the given target point
+
+        :param position: (x, y, z) in metres
+        :param bool force: send the target to both even if it has barely moved
+        :return: None
+        """
 
-    def gaze_at_point(self, position):
         x = position[0]
         y = position[1]
         z = position[2]
 
-        self.point_eyes_at_point(x, y, z, self.eye_speed)
-        self.face_toward_point(x, y, z, self.head_speed)
+        with self.lock:
+            eyes, head = self.output.update(position, force=force)
+        if eyes:
+            self.point_eyes_at_point(x, y, z, self.eye_speed)
+        if head:
+            self.face_toward_point(x, y, z, self.head_speed)
         self.last_position = position
 
     def point_eyes_at_point(self, x, y, z, speed):
@@ -1,68 +1,249 @@
+import json
+import threading
+import time
 from Queue import Queue, Empty
 
 import rospy
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus
 from dynamic_reconfigure.server import Server
+from ghost_bridge import constants
 from ghost_bridge.action_feedback_ctrl import ActionFeedbackCtrl
+from ghost_bridge.backends import SocketBackend
+from ghost_bridge.face_perception import FacePerception
+from ghost_bridge.face_registry import FACE_HANDLES_PARAM
+from ghost_bridge.metrics import Metrics
 from ghost_bridge.cfg import GhostBridgeConfig
-from ghost_bridge.msg import GhostSay
+from ghost_bridge.msg import GhostSay, GazeActionGoal, GazeRetarget
 from ghost_bridge.perception_ctrl import PerceptionCtrl
+from ghost_bridge.rate_controller import AimdRateController
+from ghost_bridge.recorder import Recorder
+from ghost_bridge.tracing import LatencyTracer
 from hr_msgs.msg import ChatMessage
 from hr_msgs.msg import TTS
 from ros_people_model.msg import Faces
 from std_msgs.msg import String, Float64
+from std_srvs.srv import Trigger, TriggerResponse
 import logging
 
 logger = logging.getLogger('ghost.ghost_bridge')
 
 
 class GhostBridge:
-    EMOTION_MAP = {
-        0: "anger",
-        1: "disgust",
-        2: "fear",
-        3: "happy",
-        4: "sad",
-        5: "surprise",
-        6: "neutral"
-    }
-
-    EYE_MAP = {
-        0: "left",
-        1: "right"
-    }
-
-
-    def __init__(self):
-        self.hostname = "localhost"
-        self.port = 17001
-
-        self.action_feedback_ctrl = ActionFeedbackCtrl(self.hostname, self.port)
-        self.perception_ctrl = PerceptionCtrl(self.hostname, self.port)
+    EMOTION_MAP = constants.EMOTION_MAP
+    EYE_MAP = constants.EYE_MAP
+    PERCEPTION_CACHE_MAX_AGE = constants.PERCEPTION_CACHE_MAX_AGE
+
+
+    def __init__(self, backend=None):
+        """
+        :param ghost_bridge.backends.Backend backend: where perceptions and action feedback are delivered, defaults
+                                                      to a SocketBackend to the CogServer given by the params
+        """
+
+        self.hostname = rospy.get_param("~cogserver_host", "localhost")
+        self.port = rospy.get_param("~cogserver_port", 17001)
+        self.cogserver_healthy = None
+
+        # Command counts, bytes, errors and latencies, published on /diagnostics
+        self.metrics = Metrics()
+
+        # Latency of each stage from a sentence being heard to the robot answering, and from a face being
+        # seen to its perceptions being queued for Ghost
+        self.speech_tracer = LatencyTracer(self.metrics, "speech")
+        self.faces_tracer = LatencyTracer(self.metrics, "faces")
+        self.face_stamps = {}  # face_id -> stamp of the latest forwarded frame holding the face
+        self.face_stamps_pruned = time.time()
+
+        # Everything received and sent can be recorded, for replaying with scripts/replay.py
+        self.recorder = None
+        record_path = rospy.get_param("~record_path", "")
+        if record_path:
+            self.recorder = Recorder(record_path)
+            rospy.loginfo("Recording to {}".format(record_path))
+
+        # One set of CogServer sessions shared by perceptions and action feedback. Callbacks queue their perceptions
+        # and return, a background thread sends them.
+        if backend is None:
+            backend = SocketBackend(self.hostname, self.port, sessions=rospy.get_param("~cogserver_sessions", 2),
+                                    pipelined=rospy.get_param("~cogserver_pipelined", True),
+                                    maxsize=rospy.get_param("~send_queue_size", 256),
+                                    telemetry_max_age=rospy.get_param("~telemetry_max_age", 2.0),
+                                    conversation_max_age=rospy.get_param("~conversation_max_age", 60.0),
+                                    precision=rospy.get_param("~number_precision", 3),
+                                    metrics=self.metrics, recorder=self.recorder)
+        self.backend = backend
+        self.action_feedback_ctrl = ActionFeedbackCtrl(self.hostname, self.port, backend=self.backend,
+                                                       metrics=self.metrics)
+        self.perception_ctrl = PerceptionCtrl(self.hostname, self.port, backend=self.backend, metrics=self.metrics,
+                                              max_batch_size=rospy.get_param("~max_batch_size", 64),
+                                              max_batch_delay=rospy.get_param("~max_batch_delay", 0.05),
+                                              precision=rospy.get_param("~number_precision", 3),
+                                              bulk=rospy.get_param("~bulk_perception", True))
         self.robot_name = rospy.get_param("robot_name")
         self.face_id = ""
         self.tts_speaking = False
         self.sr_continuous = True
         self.sr_tts_timeout = 0.0
 
+        # The action node can perceive the faces inside of the CogServer instead, see ~in_process_perception, in
+        # which case the bridge leaves them alone and has no face perception pipeline
+        self.forward_faces = rospy.get_param("~forward_faces", True)
+
+        # Which faces are in view, and which of their perceptions are sent. Blinks and eye closures are sent rather
+        # than the raw eye states of every frame, unless ~eye_events is off. Ghost rules can instead pull eye states
+        # and emotion levels from the action node's perception store, see actions.scm, in which case only presence
+        # and dominant emotion changes are pushed. Ghost is told when a face appears and when it is lost, and with
+        # ~intern_face_ids sees short handles instead of face ids, which are published to ~face_handles_param for
+        # the face tracker and the action node.
+        self.face_perception = None
+        if self.forward_faces:
+            face_handles_param = rospy.get_param("~face_handles_param", FACE_HANDLES_PARAM)
+            self.face_perception = FacePerception(
+                self.perception_ctrl, eye_events=rospy.get_param("~eye_events", True),
+                pull_perceptions=rospy.get_param("~pull_perceptions", False),
+                face_lost_timeout=rospy.get_param("~face_lost_timeout", 10.0),
+                intern_face_ids=rospy.get_param("~intern_face_ids", False),
+                handles_cb=lambda handles: rospy.set_param(face_handles_param, handles))
+
+        # Only the latest Faces message is kept, and forwarded at the rate the CogServer can absorb
+        self.latest_faces = None
+        self.latest_faces_trace = None
+        self.faces_cond = threading.Condition()
+        self.faces_rate = AimdRateController()
+
         # max size of 1 so that we all ways have the latest ChatScript answer if there is one
         self.cs_fallback_queue = Queue(maxsize=1)
 
         self.tts_pub = rospy.Publisher(self.robot_name + "/tts", TTS, queue_size=1)
+        self.diagnostics_pub = rospy.Publisher("/diagnostics", DiagnosticArray, queue_size=1)
+
+        # The callback for each inbound channel, by the name it has in recordings
+        self.inbound_callbacks = {
+            "say": self.ghost_say_cb,
+            "chatbot_responses": self.cs_say_cb,
+            "speech_events": self.tts_say_cb,
+            "words": self.perceive_word_cb,
+            "speech": self.perceive_sentence_cb,
+            "faces": self.faces_latest_cb,
+            "neck": self.gaze_position_cb,
+            "gaze_goal": self.gaze_goal_cb,
+            "gaze_retarget": self.gaze_retarget_cb
+        }
 
-        rospy.Subscriber('/ghost_bridge/say', GhostSay, self.ghost_say_cb)
-        rospy.Subscriber(self.robot_name + "/chatbot_responses", TTS, self.cs_say_cb)
-        rospy.Subscriber(self.robot_name + "/speech_events", String, self.tts_say_cb)
-        rospy.Subscriber(self.robot_name + "/words", ChatMessage, self.perceive_word_cb)
-        rospy.Subscriber(self.robot_name + "/speech", ChatMessage, self.perceive_sentence_cb)
-        rospy.Subscriber('/faces_throttled', Faces, self.faces_cb)
+        rospy.Subscriber('/ghost_bridge/say', GhostSay, self.inbound_cb("say"))
+        rospy.Subscriber(self.robot_name + "/chatbot_responses", TTS, self.inbound_cb("chatbot_responses"))
+        rospy.Subscriber(self.robot_name + "/speech_events", String, self.inbound_cb("speech_events"))
+        rospy.Subscriber(self.robot_name + "/words", ChatMessage, self.inbound_cb("words"))
+        rospy.Subscriber(self.robot_name + "/speech", ChatMessage, self.inbound_cb("speech"))
         rospy.Subscriber(self.robot_name + "/safe/Neck_Rotation_controller/command", Float64,
-                         self.gaze_position_cb, queue_size=1)
+                         self.inbound_cb("neck"), queue_size=1)
+        if self.forward_faces:
+            rospy.Subscriber('/faces', Faces, self.inbound_cb("faces"), queue_size=1)
+            rospy.Subscriber('/gaze_action/goal', GazeActionGoal, self.inbound_cb("gaze_goal"))
+            rospy.Subscriber('/gaze_action/retarget', GazeRetarget, self.inbound_cb("gaze_retarget"))
 
         self.dynamic_reconfigure_srv = Server(GhostBridgeConfig, self.dynamic_reconfigure_callback)
 
+        rospy.Service("~dump_metrics", Trigger, self.dump_metrics_cb)
+        rospy.Service("~latency_report", Trigger, self.latency_report_cb)
+
+        rospy.Timer(rospy.Duration(5), self.cogserver_health_cb)
+        rospy.Timer(rospy.Duration(rospy.get_param("~diagnostics_period", 5.0)), self.diagnostics_cb)
+        rospy.on_shutdown(self.shutdown)
+
+        if self.forward_faces:
+            rospy.Timer(rospy.Duration(1), self.face_registry_cb)
+            self.faces_thread = threading.Thread(target=self.faces_forward_loop, name="faces_forwarder")
+            self.faces_thread.daemon = True
+            self.faces_thread.start()
+
+    def inbound_cb(self, name):
+        """ The subscriber callback for an inbound channel, which records each message first if recording
+
+        :param str name: the name of the channel
+        :return: callable
+        """
+
+        callback = self.inbound_callbacks[name]
+        if self.recorder is None:
+            return callback
+
+        def record_and_call(msg):
+            self.recorder.inbound(name, msg)
+            callback(msg)
+        return record_and_call
+
+    def shutdown(self):
+        with self.faces_cond:
+            self.faces_cond.notify_all()
+        self.backend.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def cogserver_health_cb(self, event):
+        healthy = self.backend.is_healthy()
+        if healthy != self.cogserver_healthy:
+            if healthy:
+                rospy.loginfo("CogServer connection healthy: {}".format(self.backend.health()))
+            else:
+                rospy.logwarn("CogServer connection unhealthy: {}, {} perceptions dropped".format(
+                    self.backend.health(), self.backend.dropped()))
+        self.cogserver_healthy = healthy
+
+    def face_registry_cb(self, event):
+        self.face_perception.expire()
+
+    def transport_state(self):
+        """ The state of the backend, e.g. the sender lanes and CogServer sessions, and the faces forwarding rate
+
+        :return: dict
+        """
+
+        state = self.backend.state()
+        if self.face_perception is not None:
+            state["faces_rate"] = self.faces_rate.rate
+            for key, value in self.face_perception.stats().items():
+                state["faces.{}".format(key)] = value
+        return state
+
+    def diagnostics_cb(self, event):
+        dropped = self.backend.dropped()
+        if not self.backend.is_available():
+            level, message = DiagnosticStatus.ERROR, "CogServer unreachable"
+        elif dropped > 0:
+            level, message = DiagnosticStatus.WARN, "{} perceptions dropped".format(dropped)
+        else:
+            level, message = DiagnosticStatus.OK, "OK"
+
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        msg.status = [self.metrics.diagnostic_status("ghost_bridge: CogServer transport", level, message,
+                                                     extra=self.transport_state())]
+        self.diagnostics_pub.publish(msg)
+
+    def dump_metrics_cb(self, req):
+        stats = self.metrics.snapshot()
+        stats.update(self.transport_state())
+        return TriggerResponse(success=True, message=json.dumps(stats, sort_keys=True))
+
+    def latency_report_cb(self, req):
+        return TriggerResponse(success=True, message=self.speech_tracer.report() + "\n" + self.faces_tracer.report())
+
     def dynamic_reconfigure_callback(self, config, level):
         self.sr_continuous = config['sr_continuous']
         self.sr_tts_timeout = config['sr_tts_timeout']
+        if self.face_perception is not None:
+            self.face_perception.perception_cache.delta = config['perception_delta']
+            self.face_perception.perception_cache.keepalive = config['perception_keepalive']
+            self.face_perception.emotion_aggregator.smoothing = config['emotion_smoothing']
+            self.face_perception.emotion_aggregator.top_k = config['emotion_top_k']
+            self.face_perception.emotion_aggregator.interval = config['emotion_interval']
+            self.face_perception.face_selector.budget = config['face_budget']
+            self.face_perception.face_selector.heartbeat_interval = config['face_heartbeat_interval']
+            self.face_perception.face_selector.max_heartbeats = config['face_max_heartbeats']
+            self.faces_rate.min_rate = config['faces_min_rate']
+            self.faces_rate.max_rate = max(config['faces_min_rate'], config['faces_max_rate'])
+            self.faces_rate.target_latency = config['faces_target_latency']
         rospy.logdebug("Dynamic reconfigure callback result: {0}".format(config))
         return config
 
@@ -86,6 +267,12 @@ class GhostBridge:
     def ghost_say_cb(self, msg):
         rospy.logdebug("ghost_say_cb: '{}', '{}'".format(msg.text, msg.fallback_id))
 
+        # The trace of the sentence Ghost is answering, if the action node could tell which one that was
+        trace_id = msg.trace_id or None
+        if not msg.stamp.is_zero():
+            self.speech_tracer.mark(trace_id, "ghost_said", msg.stamp.to_sec())
+        self.speech_tracer.mark(trace_id, "say_received")
+
         if msg.fallback_id == "chatscript":
             try:
                 # wait for three seconds if no new response to give ChatScript a chance.
@@ -93,40 +280,113 @@ class GhostBridge:
             except Empty:
                 cs_fallback_text = ""
                 rospy.logwarn("cs_fallback_text is ''")
-            self.publish_tts(cs_fallback_text)
+            self.speech_tracer.mark(trace_id, "fallback_received")
+            self.publish_tts(cs_fallback_text, trace_id)
         else:
-            self.publish_tts(msg.text)
+            self.publish_tts(msg.text, trace_id)
 
-    def publish_tts(self, text):
+    def publish_tts(self, text, trace_id=None):
         msg = TTS()
         msg.text = text
         msg.lang = 'en-US'
         self.tts_pub.publish(msg)
+        self.speech_tracer.finish(trace_id, "tts_published")
         rospy.logdebug("published tts: '{}', '{}'".format(msg.text, msg.lang))
 
     def perceive_word_cb(self, msg):
-        self.perception_ctrl.perceive_word(self.face_id, msg.utterance)
-        self.perception_ctrl.perceive_face_talking(self.face_id, 1.0)
+        with self.perception_ctrl.batch():
+            self.perception_ctrl.perceive_word(self.face_id, msg.utterance)
+            self.perception_ctrl.perceive_face_talking(self.face_id, 1.0)
 
     def perceive_sentence_cb(self, msg):
         if self.sr_continuous or not self.tts_speaking:
-            self.perception_ctrl.perceive_sentence(self.face_id, msg.utterance)
-            self.perception_ctrl.perceive_face_talking(self.face_id, 0.0)
+            trace_id = self.speech_tracer.start("speech_received")
+            with self.perception_ctrl.batch():
+                self.perception_ctrl.perceive_sentence(self.face_id, msg.utterance, trace_id)
+                self.perception_ctrl.perceive_face_talking(self.face_id, 0.0)
+            self.speech_tracer.mark(trace_id, "ghost_queued")
         else:
             rospy.logdebug("suppressing sentence perceived to GHOST")
 
+    def faces_latest_cb(self, data):
+        # Faces messages may not carry a header, in which case the trace starts when the message arrives
+        header = getattr(data, "header", None)
+        if header is not None and not header.stamp.is_zero():
+            trace_id = self.faces_tracer.start("faces_stamped", header.stamp.to_sec())
+            self.faces_tracer.mark(trace_id, "faces_received")
+        else:
+            trace_id = self.faces_tracer.start("faces_received")
+
+        # Blinks are too short to survive conflation, so the eyes are followed in every message
+        self.face_perception.observe(data.faces)
+
+        # Conflate: a newer message replaces one that hasn't been forwarded yet
+        with self.faces_cond:
+            if self.latest_faces is not None:
+                self.faces_tracer.discard(self.latest_faces_trace)
+                self.metrics.increment("faces_conflated")
+            self.latest_faces = data
+            self.latest_faces_trace = trace_id
+            self.faces_cond.notify()
+
+    def faces_forward_loop(self):
+        while not rospy.is_shutdown():
+            with self.faces_cond:
+                while self.latest_faces is None and not rospy.is_shutdown():
+                    self.faces_cond.wait(1.0)
+                data = self.latest_faces
+                trace_id = self.latest_faces_trace
+                self.latest_faces = None
+
+            if data is None:
+                continue
+
+            start = time.time()
+            self.faces_tracer.mark(trace_id, "faces_forwarded")
+            try:
+                self.faces_cb(data)
+            except Exception as e:
+                rospy.logerr("Failed to forward faces: {}".format(e))
+            self.faces_tracer.finish(trace_id, "perceptions_queued")
+
+            stamp = rospy.get_time()
+            for face in data.faces:
+                self.face_stamps[face.face_id] = stamp
+            if start - self.face_stamps_pruned > GhostBridge.PERCEPTION_CACHE_MAX_AGE:
+                for face_id in [face_id for face_id, t in self.face_stamps.items()
+                                if stamp - t > GhostBridge.PERCEPTION_CACHE_MAX_AGE]:
+                    del self.face_stamps[face_id]
+                self.face_stamps_pruned = start
+
+            # Back off when payloads wait too long to be acknowledged, the pipeline fills up or stalls, or the
+            # telemetry queue backs up
+            rate = self.faces_rate.update(self.backend.latency(), self.backend.queue_depth(),
+                                          self.backend.pipeline_depth(), self.backend.stalls())
+            time.sleep(max(0.0, 1.0 / rate - (time.time() - start)))
+
     def faces_cb(self, data):
-        for face in data.faces:
-            self.perception_ctrl.perceive_face(face.face_id, face.position.x, face.position.y, face.position.z,
-                                               face.certainty)
+        self.face_perception.perceive(data.faces)
+
+    def gaze_goal_cb(self, msg):
+        if self.face_perception is None:
+            return
+
+        # Ghost choosing to look at a face counts as interacting with it
+        face_id = self.face_perception.face_registry.resolve(msg.goal.target)
+        self.face_perception.mark_interaction(face_id)
+
+        # Time from a face's perceptions being queued for Ghost to Ghost deciding to look at it
+        stamp = self.face_stamps.get(face_id)
+        if stamp is not None and not msg.header.stamp.is_zero():
+            latency = max(0.0, msg.header.stamp.to_sec() - stamp)
+            self.metrics.observe("trace.faces.perceptions_queued->gaze_goal", latency)
 
-            if len(face.eye_states) > 0:
-                for i, state in enumerate(face.eye_states):
-                    self.perception_ctrl.perceive_eye_state(face.face_id, GhostBridge.EYE_MAP[i], state)
+    def gaze_retarget_cb(self, msg):
+        if self.face_perception is None:
+            return
 
-            if len(face.emotions) > 0:
-                for i, confidence in enumerate(face.emotions):
-                    self.perception_ctrl.perceive_emotion(face.face_id, GhostBridge.EMOTION_MAP[i], confidence)
+        # Ghost pointing its running gaze goal at another face counts as interacting with it too
+        self.face_perception.mark_interaction(msg.target)
 
     def gaze_position_cb(self, msg):
         angle = msg.data
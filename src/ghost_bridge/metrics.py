@@ -0,0 +1,170 @@
+#
+# metrics.py - Counters and latency histograms for the CogServer transport.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import bisect
+import threading
+
+from diagnostic_msgs.msg import DiagnosticStatus, KeyValue
+
+
+class LatencyHistogram(object):
+    """
+        A histogram of durations in seconds with logarithmically spaced buckets, from 100us to about 30s. Cheap to
+        update, and accurate to within one bucket (about 25%) when estimating percentiles.
+    """
+
+    BOUNDS = [0.0001 * (1.25 ** i) for i in range(57)]
+
+    def __init__(self):
+        self.counts = [0] * (len(LatencyHistogram.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(LatencyHistogram.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """ Estimate a percentile
+
+        :param float p: the percentile from 0.0 to 1.0
+        :return: the upper bound of the bucket holding the percentile, in seconds
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n > 0:
+                return min(LatencyHistogram.BOUNDS[i], self.max) if i < len(LatencyHistogram.BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max
+        }
+
+
+class Metrics(object):
+    """
+        Thread safe named counters and latency histograms.
+
+        Example:
+            metrics = Metrics()
+            metrics.command('(perceive-face "a4f3" 0.9)\\n')  # counts commands.perceive-face and bytes.perceive-face
+            metrics.increment("write_errors")
+            metrics.observe("write_latency", 0.004)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def command(self, content):
+        """ Count a scheme command, and the bytes it takes, under the name of the procedure it calls
+
+        :param str content: a newline terminated scheme expression
+        :return: None
+        """
+
+        end = content.find(' ')
+        if end < 0:
+            end = content.find(')')
+        self.count_command(content[1:end], len(content))
+
+    def count_command(self, name, size):
+        """ Count a scheme command that has already been encoded
+
+        :param str name: the name of the procedure it calls
+        :param int size: its length in bytes
+        :return: None
+        """
+
+        with self.lock:
+            self.counters["commands." + name] = self.counters.get("commands." + name, 0) + 1
+            self.counters["bytes." + name] = self.counters.get("bytes." + name, 0) + size
+
+    def summaries(self, prefix=""):
+        """ Summaries of the histograms whose names start with prefix
+
+        :param str prefix: the start of the histogram names
+        :return: dict of histogram name to summary
+        """
+
+        with self.lock:
+            return dict((name, histogram.summary()) for name, histogram in self.histograms.items()
+                        if name.startswith(prefix))
+
+    def snapshot(self):
+        """ The current value of every counter and a summary of every histogram
+
+        :return: dict
+        """
+
+        with self.lock:
+            snapshot = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                for key, value in histogram.summary().items():
+                    snapshot["{}.{}".format(name, key)] = value
+            return snapshot
+
+    def diagnostic_status(self, name, level=DiagnosticStatus.OK, message="", extra=None):
+        """ Package a snapshot as a diagnostic_msgs DiagnosticStatus
+
+        :param str name: the name of the status
+        :param int level: DiagnosticStatus.OK, WARN or ERROR
+        :param str message: a summary of the status
+        :param dict extra: additional values to include
+        :return: diagnostic_msgs.msg.DiagnosticStatus
+        """
+
+        values = self.snapshot()
+        if extra is not None:
+            values.update(extra)
+
+        status = DiagnosticStatus()
+        status.name = name
+        status.hardware_id = "cogserver"
+        status.level = level
+        status.message = message
+        status.values = [KeyValue(key=key, value=str(values[key])) for key in sorted(values)]
+        return status
@@ -0,0 +1,105 @@
+#
+# motion_model.py - Predict where a tracked face is between tf updates.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+class ConstantVelocityModel(object):
+    """
+        An alpha-beta filter over a 3D position. Each measurement corrects the predicted position by alpha of the
+        error and the velocity by beta of it, and in between measurements the position is extrapolated along the
+        velocity, for at most max_prediction seconds so a face that stops being seen doesn't drift off.
+
+        Example:
+            model = ConstantVelocityModel()
+            model.update((1.0, 0.0, 0.0), 10.0)
+            model.update((1.0, 0.1, 0.0), 11.0)
+            model.predict(11.2)  # about (1.0, 0.11, 0.0)
+    """
+
+    def __init__(self, alpha=0.85, beta=0.3, max_prediction=0.5, max_speed=2.0):
+        """
+        :param float alpha: the share of the position error corrected by each measurement, from 0.0 to 1.0
+        :param float beta: the share of the velocity error corrected by each measurement, from 0.0 to 1.0
+        :param float max_prediction: the most seconds the position is extrapolated past the last measurement
+        :param float max_speed: metres per second, faster estimates are clamped, e.g. after a face id is reassigned
+        """
+
+        self.alpha = alpha
+        self.beta = beta
+        self.max_prediction = max_prediction
+        self.max_speed = max_speed
+        self.reset()
+
+    def reset(self):
+        """ Forget the track
+
+        :return: None
+        """
+
+        self.position = None
+        self.velocity = [0.0, 0.0, 0.0]
+        self.stamp = None
+        self.updates = 0
+
+    def is_initialized(self):
+        return self.position is not None
+
+    def update(self, position, stamp):
+        """ Add a measurement
+
+        :param position: (x, y, z) in metres
+        :param float stamp: when the position was measured, in seconds
+        :return: None
+        """
+
+        if self.position is None:
+            self.position = list(position)
+            self.velocity = [0.0, 0.0, 0.0]
+            self.stamp = stamp
+            self.updates = 1
+            return
+
+        dt = stamp - self.stamp
+        if dt <= 0:
+            # The same transform again, or an older one
+            return
+
+        predicted = [p + v * dt for p, v in zip(self.position, self.velocity)]
+        residual = [m - p for m, p in zip(position, predicted)]
+        self.position = [p + self.alpha * r for p, r in zip(predicted, residual)]
+        self.velocity = [v + self.beta * r / dt for v, r in zip(self.velocity, residual)]
+
+        speed = sum(v * v for v in self.velocity) ** 0.5
+        if speed > self.max_speed:
+            self.velocity = [v * self.max_speed / speed for v in self.velocity]
+
+        self.stamp = stamp
+        self.updates += 1
+
+    def predict(self, stamp):
+        """ The position at a point in time
+
+        :param float stamp: seconds
+        :return: [x, y, z], or None if there have been no measurements
+        """
+
+        if self.position is None:
+            return None
+
+        dt = min(max(0.0, stamp - self.stamp), self.max_prediction)
+        return [p + v * dt for p, v in zip(self.position, self.velocity)]
@@ -40,7 +40,6 @@ def netcat(hostname, port, content):
         return 1  # non-zero means failure
 
     rospy.logdebug("netcat sending: %s" % content)
-    print("netcat sending: %s" % content)
 
     s.sendall(content)
     s.shutdown(socket.SHUT_WR)
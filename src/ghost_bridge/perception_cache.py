@@ -0,0 +1,89 @@
+#
+# perception_cache.py - Suppress perceptions that haven't changed.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import time
+
+
+class PerceptionStateCache(object):
+    """
+        Remembers the last value sent to Ghost for each (face_id, channel), e.g. ('a4f3...', 'emotion:happy'),
+        so that values which have barely moved since they were last sent can be suppressed.
+    """
+
+    def __init__(self, delta=0.05, keepalive=5.0):
+        """
+        :param float delta: a value is only sent again once it has moved at least this far from the last value sent
+        :param float keepalive: seconds after which a value is sent again even if it hasn't changed, 0 to disable
+        """
+
+        self.delta = delta
+        self.keepalive = keepalive
+        self.last_sent = {}  # (face_id, channel) -> (value, time sent)
+
+        self.forwarded = 0
+        self.suppressed = 0
+
+    def should_send(self, face_id, channel, value, now=None):
+        """ Decide whether a value should be sent to Ghost, and if so remember it as the last value sent
+
+        :param str face_id: the id of the face
+        :param str channel: the name of the perception channel, e.g. 'emotion:happy' or 'eye:left'
+        :param float value: the perceived value
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: True if the value should be sent
+        """
+
+        if now is None:
+            now = time.time()
+
+        key = (face_id, channel)
+        last = self.last_sent.get(key)
+        send = last is None or abs(value - last[0]) >= self.delta or \
+            (self.keepalive > 0 and now - last[1] >= self.keepalive)
+
+        if send:
+            self.last_sent[key] = (value, now)
+            self.forwarded += 1
+        else:
+            self.suppressed += 1
+        return send
+
+    def forget(self, face_id):
+        """ Forget every value sent for a face
+
+        :param str face_id: the id of the face
+        :return: None
+        """
+
+        for key in [key for key in self.last_sent if key[0] == face_id]:
+            del self.last_sent[key]
+
+    def prune(self, max_age, now=None):
+        """ Forget values that haven't been sent for max_age seconds, e.g. those of faces that have left the view
+
+        :param float max_age: seconds
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if now is None:
+            now = time.time()
+
+        for key in [key for key, (value, sent) in self.last_sent.items() if now - sent > max_age]:
+            del self.last_sent[key]
@@ -19,19 +19,190 @@
 # Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from ghost_bridge.netcat import netcat
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ghost_bridge.backends import SocketBackend
+from ghost_bridge.scheme_encoder import SchemeEncoder
+from ghost_bridge.sender import CONVERSATION, TELEMETRY
 
 
 # The code here is a quick, cheap hack to place information into the
-# cogserver atomspace. It opens a socket to the cogserver, and sends
-# scheme snippets across.  These are usually some Atomese.
+# cogserver atomspace. It keeps a session open to the cogserver, and sends
+# scheme snippets across.  These are usually some Atomese. Snippets are
+# queued and sent from a background thread, so perceiving never blocks.
+# Speech goes in the conversation lane, ahead of face telemetry.
+#
+# The snippets are written by a SchemeEncoder, which escapes strings and
+# rounds numbers. A batch is encoded straight into one buffer per lane and
+# thread, and each lane's buffer is sent as its own payload, so batching
+# never promotes telemetry to the conversation lane.
+#
+# In bulk mode the face, eye and emotion perceptions made inside a frame()
+# block are sent as a single perceive-frame call, defined in
+# scripts/perceptions.scm, so the CogServer evaluates one expression per
+# Faces message rather than one per perception.
 
 class PerceptionCtrl:
 
-    def __init__(self, hostname, port):
+    def __init__(self, hostname, port, backend=None, metrics=None, max_batch_size=64, max_batch_delay=0.05,
+                 precision=3, bulk=True):
         self.hostname = hostname
         self.port = port
 
+        # The backend delivers the commands, and can be shared with the ActionFeedbackCtrl
+        if backend is None:
+            backend = SocketBackend(hostname, port, precision=precision)
+        self.backend = backend
+
+        # Counts the commands sent, and their bytes, by type
+        self.metrics = metrics
+
+        # Numbers are sent with precision decimal places
+        self.encoder = SchemeEncoder(precision)
+
+        # Perceptions sent inside a batch() block are collected per thread, since
+        # each ROS subscriber callback runs in its own thread.
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.batches = threading.local()
+
+        # Face perceptions made inside a frame() block, per thread
+        self.bulk = bulk
+        self.frames = threading.local()
+
+    @contextmanager
+    def batch(self):
+        """ Collect every perception sent inside the block and send them to the CogServer as one payload.
+        The batch is also flushed early once it holds max_batch_size perceptions or is older than max_batch_delay
+        seconds.
+
+        Example:
+            with ctrl.batch():
+                ctrl.perceive_word(face_id, word)
+                ctrl.perceive_face_talking(face_id, 1.0)
+
+        :return: None
+        """
+
+        state = self.batches
+        if getattr(state, 'depth', 0) == 0:
+            state.depth = 0
+            if getattr(state, 'buffers', None) is None:
+                state.buffers = [bytearray(), bytearray()]  # by lane
+                state.counts = [0, 0]
+            state.started = time.time()
+
+        state.depth += 1
+        try:
+            yield
+        finally:
+            state.depth -= 1
+            if state.depth == 0:
+                self.flush()
+
+    @contextmanager
+    def frame(self):
+        """ Collect the face, eye and emotion perceptions made inside the block into one perceive-frame command in
+        bulk mode. Otherwise the block is the same as a batch().
+
+        Example:
+            with ctrl.frame():
+                for face in faces:
+                    ctrl.perceive_face(face.face_id, x, y, z, face.certainty)
+                    ctrl.perceive_emotion(face.face_id, "happy", 0.8)
+
+        :return: None
+        """
+
+        with self.batch():
+            if not self.bulk or not self.backend.batched or getattr(self.frames, 'faces', None) is not None:
+                yield
+                return
+
+            self.frames.faces = OrderedDict()
+            try:
+                yield
+            finally:
+                faces = self.frames.faces
+                self.frames.faces = None
+                if faces:
+                    self.command("perceive-frame", ([tuple(face) for face in faces.values()],))
+
+    def frame_face(self, face_id):
+        """ The entry of a face in the current thread's frame, if one is being collected
+
+        :return: [face_id, confidence, eyes, emotions, dominant emotion], or None
+        """
+
+        faces = getattr(self.frames, 'faces', None)
+        if faces is None:
+            return None
+
+        face = faces.get(face_id)
+        if face is None:
+            face = faces[face_id] = [face_id, None, [], [], None]
+        return face
+
+    def flush(self):
+        """ Send the perceptions collected by the current thread's batch
+
+        :return: 0 on success, non-zero on failure
+        """
+
+        state = self.batches
+        state.started = time.time()
+        if not any(getattr(state, 'counts', ())):
+            return 0
+
+        # The conversation goes first, as the sender would send it
+        result = 0
+        for lane in (CONVERSATION, TELEMETRY):
+            if state.counts[lane]:
+                content = str(state.buffers[lane])
+                del state.buffers[lane][:]
+                state.counts[lane] = 0
+                result = self.backend.send(content, lane) or result
+        return result
+
+    def command(self, name, args, lane=TELEMETRY):
+        """ Encode a command and send it, or add it to the current batch if there is one
+
+        :param str name: the name of the scheme procedure, one of scheme_encoder.COMMANDS
+        :param tuple args: the arguments of the procedure
+        :param int lane: the sender lane, either CONVERSATION or TELEMETRY
+        :return: 0 on success, non-zero on failure
+        """
+
+        # Backends that don't send scheme take the command as it is
+        if not self.backend.batched:
+            if self.metrics is not None:
+                self.metrics.count_command(name, 0)
+            return self.backend.command(name, args, lane)
+
+        state = self.batches
+        if getattr(state, 'depth', 0) == 0:
+            content = self.encoder.encode(name, *args)
+            size = len(content)
+        else:
+            content = None
+            size = self.encoder.encode_into(state.buffers[lane], name, *args)
+
+        if self.metrics is not None:
+            self.metrics.count_command(name, size)
+
+        if content is not None:
+            return self.backend.send(content, lane)
+        return self.added(state, lane)
+
+    def added(self, state, lane):
+        state.counts[lane] += 1
+        if sum(state.counts) >= self.max_batch_size or time.time() - state.started >= self.max_batch_delay:
+            return self.flush()
+        return 0
+
     def perceive_face(self, face_id, x, y, z, confidence):
         """ Perceive a face
 
@@ -43,8 +214,31 @@ class PerceptionCtrl:
         :return: None
         """
 
-        content = '(perceive-face "{}" {})\n'.format(face_id, confidence)
-        netcat(self.hostname, self.port, content)
+        face = self.frame_face(face_id)
+        if face is not None:
+            face[1] = confidence
+            return
+
+        self.command("perceive-face", (face_id, confidence))
+
+    def perceive_face_appeared(self, face_id):
+        """ Perceive a face coming into view
+
+        :param str face_id: the id of the face
+        :return: None
+        """
+
+        # Lifecycle events go in the conversation lane, so they are never dropped as stale telemetry
+        self.command("perceive-face-appeared", (face_id,), CONVERSATION)
+
+    def perceive_face_lost(self, face_id):
+        """ Perceive that a face has been out of view long enough to be forgotten
+
+        :param str face_id: the id of the face
+        :return: None
+        """
+
+        self.command("perceive-face-lost", (face_id,), CONVERSATION)
 
     def perceive_emotion(self, face_id, emotion_id, confidence):
         """ Perceive an emotion
@@ -55,8 +249,27 @@ class PerceptionCtrl:
         :return: None
         """
 
-        content = '(perceive-emotion "{}" "{}" {})\n'.format(face_id, emotion_id, confidence)
-        netcat(self.hostname, self.port, content)
+        face = self.frame_face(face_id)
+        if face is not None:
+            face[3].append((emotion_id, confidence))
+            return
+
+        self.command("perceive-emotion", (face_id, emotion_id, confidence))
+
+    def perceive_dominant_emotion(self, face_id, emotion_id):
+        """ Perceive that the dominant emotion of a face has changed
+
+        :param str face_id: the id of the face
+        :param str emotion_id: the id of the new dominant emotion
+        :return: None
+        """
+
+        face = self.frame_face(face_id)
+        if face is not None:
+            face[4] = emotion_id
+            return
+
+        self.command("perceive-dominant-emotion", (face_id, emotion_id))
 
     def perceive_eye_state(self, face_id, eye_id, state):
         """ Perceive the state of a person's eyes
@@ -67,8 +280,24 @@ class PerceptionCtrl:
         :return: None
         """
 
-        content = '(perceive-eye-state "{}" "{}" {})\n'.format(face_id, eye_id, state)
-        netcat(self.hostname, self.port, content)
+        face = self.frame_face(face_id)
+        if face is not None:
+            face[2].append((eye_id, state))
+            return
+
+        self.command("perceive-eye-state", (face_id, eye_id, state))
+
+    def perceive_eye_event(self, face_id, event, duration, stamp):
+        """ Perceive a blink, or a person closing or opening their eyes
+
+        :param str face_id: the id of the face
+        :param str event: the event, one of 'blink', 'eyes-closed' or 'eyes-opened'
+        :param float duration: the seconds the eyes were closed for
+        :param float stamp: when the event was perceived, in seconds since the epoch
+        :return: None
+        """
+
+        self.command("perceive-eye-event", (face_id, event, duration, stamp))
 
     def perceive_face_talking(self, face_id, confidence):
         """ Perceive the state of a person's eyes
@@ -78,8 +307,7 @@ class PerceptionCtrl:
         :return: None
         """
 
-        content = '(perceive-face-talking "{}" {})\n'.format(face_id, confidence)
-        netcat(self.hostname, self.port, content)
+        self.command("perceive-face-talking", (face_id, confidence))
 
     def perceive_word(self, face_id, word):
         """ Perceive an individual word that is a part of the sentence a person is currently speaking
@@ -89,20 +317,20 @@ class PerceptionCtrl:
         :return: None
         """
 
-        content = '(perceive-word "{}" "{}")\n'.format(face_id, word)
-        netcat(self.hostname, self.port, content)
+        self.command("perceive-word", (face_id, word), CONVERSATION)
 
-    def perceive_sentence(self, face_id, sentence):
+    def perceive_sentence(self, face_id, sentence, trace_id=None):
         """ Perceive the whole sentence after the user has finished speaking
 
         :param str face_id: the id of the face
         :param str sentence: the perceived sentence
+        :param int trace_id: the latency trace of the sentence, handed back with Ghost's answer if given
         :return: None
         """
 
-        content = '(ghost "{}")\n'.format(sentence)
-        netcat(self.hostname, self.port, content)
+        if trace_id is not None:
+            self.command("perceive-sentence-trace", (trace_id,), CONVERSATION)
+        self.command("ghost", (sentence,), CONVERSATION)
 
     def perceive_neck_direction(self, direction):
-        content = '(perceive-neck-dir "{}")\n'.format(direction)
-        netcat(self.hostname, self.port, content)
+        self.command("perceive-neck-dir", (direction,))
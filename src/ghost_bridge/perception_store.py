@@ -0,0 +1,303 @@
+#
+# perception_store.py - Recent face perceptions, kept for Ghost to query.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import math
+import threading
+import time
+
+import numpy as np
+
+# Rather than pushing every eye state and emotion into the atomspace, the
+# action node keeps the last few seconds of each face's perceptions in
+# fixed size ring buffers, and Ghost rules ask for what they need through
+# grounded predicates, e.g. whether a face's eyes have been closed for
+# more than two seconds.
+#
+# Each face has a slot of preallocated arrays, one row per frame:
+#
+#   stamps      (max_faces, capacity)            seconds, NaN when empty
+#   confidence  (max_faces, capacity)
+#   eye_states  (max_faces, capacity, eyes)      NaN when not perceived
+#   emotions    (max_faces, capacity, emotions)  NaN when not perceived
+#
+# The history is given in seconds. There are enough rows for history
+# seconds of frames at max_rate, and frames arriving faster than that are
+# dropped, so a fast camera can't shorten the history that queries such
+# as eyes_closed_for() can look back over.
+#
+# When every slot is taken, the face seen least recently gives up its slot.
+
+
+class PerceptionStore(object):
+    """
+        Ring buffers of the recent perceptions of each face. Safe to call from any thread.
+    """
+
+    def __init__(self, emotions, eyes=("left", "right"), history=10.0, max_rate=30.0, max_faces=16):
+        """
+        :param list emotions: the emotion names, in the order of the confidences in the Face message
+        :param list eyes: the eye names, in the order of the states in the Face message
+        :param float history: the seconds of perceptions kept per face
+        :param float max_rate: the most frames kept per second, per face
+        :param int max_faces: the number of faces kept
+        """
+
+        self.emotion_names = list(emotions)
+        self.emotion_index = dict((name, i) for i, name in enumerate(self.emotion_names))
+        self.eye_names = list(eyes)
+        self.history = history
+        self.min_interval = 1.0 / max_rate
+        self.capacity = max(1, int(math.ceil(history * max_rate)))
+        max_faces = max(1, max_faces)
+        self.max_faces = max_faces
+
+        self.lock = threading.Lock()
+        self.slots = {}  # face_id -> slot
+        self.heads = np.zeros(max_faces, dtype=np.int64)  # the row the next frame of each slot is written to
+        self.last_seen = np.full(max_faces, -np.inf)
+        self.stamps = np.full((max_faces, self.capacity), np.nan)
+        self.confidence = np.full((max_faces, self.capacity), np.nan)
+        self.eye_states = np.full((max_faces, self.capacity, len(self.eye_names)), np.nan)
+        self.emotions = np.full((max_faces, self.capacity, len(self.emotion_names)), np.nan)
+
+    def add(self, face_id, confidence, eye_states=(), emotions=(), stamp=None):
+        """ Add a frame of perceptions for a face
+
+        :param str face_id: the id of the face
+        :param float confidence: the confidence that the face is there, from 0.0 to 1.0
+        :param list eye_states: the state of each eye, from 0.0 closed to 1.0 open, empty if not perceived
+        :param list emotions: the confidence of each emotion, from 0.0 to 1.0, empty if not perceived
+        :param float stamp: when the frame was perceived in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if stamp is None:
+            stamp = time.time()
+
+        with self.lock:
+            slot = self.slots.get(face_id)
+            if slot is None:
+                slot = self._allocate(face_id)
+            elif stamp - self.last_seen[slot] < self.min_interval:
+                # Faster than max_rate, which would shorten the history
+                return
+
+            row = self.heads[slot]
+            self.stamps[slot, row] = stamp
+            self.confidence[slot, row] = confidence
+            self.eye_states[slot, row] = np.nan
+            if len(eye_states) > 0:
+                n = min(len(eye_states), len(self.eye_names))
+                self.eye_states[slot, row, :n] = eye_states[:n]
+            self.emotions[slot, row] = np.nan
+            if len(emotions) > 0:
+                n = min(len(emotions), len(self.emotion_names))
+                self.emotions[slot, row, :n] = emotions[:n]
+
+            self.heads[slot] = (row + 1) % self.capacity
+            self.last_seen[slot] = max(self.last_seen[slot], stamp)
+
+    def add_faces(self, faces, stamp=None):
+        """ Add a frame of perceptions for each face in a Faces message
+
+        :param list faces: ros_people_model.msg.Face
+        :param float stamp: when the frame was perceived in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if stamp is None:
+            stamp = time.time()
+
+        for face in faces:
+            self.add(face.face_id, face.certainty, face.eye_states, face.emotions, stamp)
+
+    def face_ids(self, max_age=None, now=None):
+        """ The faces in the store
+
+        :param float max_age: only the faces seen in the last max_age seconds, defaults to all of them
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: list of str
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            return [face_id for face_id, slot in self.slots.items()
+                    if max_age is None or now - self.last_seen[slot] <= max_age]
+
+    def seconds_since_seen(self, face_id, now=None):
+        """ Seconds since a face was last perceived
+
+        :param str face_id: the id of the face
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: float, inf if the face isn't in the store
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            slot = self.slots.get(face_id)
+            if slot is None:
+                return float("inf")
+            return now - self.last_seen[slot]
+
+    def emotion(self, face_id, emotion_id, window=1.0, now=None):
+        """ The mean confidence of one of a face's emotions over the last window seconds
+
+        :param str face_id: the id of the face
+        :param str emotion_id: the id of the emotion, e.g. 'happy'
+        :param float window: seconds
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: float, None if the emotion hasn't been perceived in the window
+        """
+
+        index = self.emotion_index.get(emotion_id)
+        if index is None:
+            return None
+
+        means = self._emotion_means(face_id, window, now)
+        if means is None or np.isnan(means[index]):
+            return None
+        return float(means[index])
+
+    def dominant_emotion(self, face_id, window=1.0, now=None):
+        """ The emotion with the highest mean confidence over the last window seconds
+
+        :param str face_id: the id of the face
+        :param float window: seconds
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: (emotion_id, confidence), or (None, 0.0) if no emotions have been perceived in the window
+        """
+
+        means = self._emotion_means(face_id, window, now)
+        if means is None or np.all(np.isnan(means)):
+            return None, 0.0
+        index = int(np.nanargmax(means))
+        return self.emotion_names[index], float(means[index])
+
+    def eyes_closed_for(self, face_id, threshold=0.3, now=None):
+        """ How long a face's eyes have been closed, i.e. every eye state has been below threshold
+
+        :param str face_id: the id of the face
+        :param float threshold: eye states below this count as closed
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: seconds, 0.0 if the eyes are open or haven't been perceived
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            slot = self.slots.get(face_id)
+            if slot is None:
+                return 0.0
+
+            # The frames with eye states, newest first
+            order = (self.heads[slot] - 1 - np.arange(self.capacity)) % self.capacity
+            stamps = self.stamps[slot, order]
+            states = self.eye_states[slot, order]
+            perceived = ~np.isnan(stamps) & np.any(~np.isnan(states), axis=1)
+            stamps = stamps[perceived]
+            states = states[perceived]
+            if len(stamps) == 0:
+                return 0.0
+
+            closed = np.all(np.isnan(states) | (states < threshold), axis=1)
+            if not closed[0]:
+                return 0.0
+
+            # The eyes closed at the oldest frame after the newest frame they were open in. If they have been closed
+            # for every frame kept, that is as far back as can be told, i.e. about history seconds.
+            open_frames = np.flatnonzero(~closed)
+            first_closed = open_frames[0] - 1 if len(open_frames) > 0 else len(stamps) - 1
+            return max(0.0, now - stamps[first_closed])
+
+    def forget(self, face_id):
+        """ Forget a face
+
+        :param str face_id: the id of the face
+        :return: None
+        """
+
+        with self.lock:
+            slot = self.slots.pop(face_id, None)
+            if slot is not None:
+                self._clear(slot)
+
+    def prune(self, max_age, now=None):
+        """ Forget the faces that haven't been seen for max_age seconds
+
+        :param float max_age: seconds
+        :param float now: the current time in seconds, defaults to time.time()
+        :return: None
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            for face_id, slot in list(self.slots.items()):
+                if now - self.last_seen[slot] > max_age:
+                    del self.slots[face_id]
+                    self._clear(slot)
+
+    def _emotion_means(self, face_id, window, now):
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            slot = self.slots.get(face_id)
+            if slot is None:
+                return None
+
+            in_window = self.stamps[slot] >= now - window
+            if not np.any(in_window):
+                return None
+            emotions = self.emotions[slot, in_window]
+            counts = np.sum(~np.isnan(emotions), axis=0)
+            sums = np.nansum(emotions, axis=0)
+        means = np.full(len(self.emotion_names), np.nan)
+        np.divide(sums, counts, out=means, where=counts > 0)
+        return means
+
+    def _allocate(self, face_id):
+        used = set(self.slots.values())
+        free = [slot for slot in range(self.max_faces) if slot not in used]
+        if free:
+            slot = free[0]
+        else:
+            # Take the slot of the face seen least recently
+            slot = int(np.argmin(self.last_seen))
+            for other, other_slot in list(self.slots.items()):
+                if other_slot == slot:
+                    del self.slots[other]
+            self._clear(slot)
+
+        self.slots[face_id] = slot
+        return slot
+
+    def _clear(self, slot):
+        self.heads[slot] = 0
+        self.last_seen[slot] = -np.inf
+        self.stamps[slot] = np.nan
+        self.confidence[slot] = np.nan
+        self.eye_states[slot] = np.nan
+        self.emotions[slot] = np.nan
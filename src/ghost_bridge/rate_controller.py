@@ -0,0 +1,78 @@
+#
+# rate_controller.py - Adapt the perception rate to what the CogServer can absorb.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+class AimdRateController(object):
+    """
+        Additive increase, multiplicative decrease control of a forwarding rate. While the CogServer keeps up, the rate
+        creeps up by a fixed step; as soon as it falls behind, the rate is cut by a factor. With pipelining a write
+        returns as soon as it is on the socket, so falling behind shows up as payloads waiting to be acknowledged
+        rather than as slow writes: the oldest of them getting old, the pipeline filling up, or a send timing out
+        waiting for room in it.
+    """
+
+    def __init__(self, min_rate=0.2, max_rate=10.0, increase=0.1, decrease=0.5, target_latency=0.1, max_queue=32,
+                 max_pipeline_depth=0.5):
+        """
+        :param float min_rate: the lowest rate in Hz
+        :param float max_rate: the highest rate in Hz
+        :param float increase: Hz added to the rate after each update where the CogServer kept up
+        :param float decrease: factor the rate is multiplied by after each update where it didn't
+        :param float target_latency: seconds a payload may wait to be taken or acknowledged before it counts as
+                                     congested
+        :param int max_queue: queued snippets above which the send queue counts as congested
+        :param float max_pipeline_depth: the share of the pipeline, from 0.0 to 1.0, that may be waiting to be
+                                         acknowledged before it counts as congested
+        """
+
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.max_queue = max_queue
+        self.max_pipeline_depth = max_pipeline_depth
+        self.rate = min_rate
+        self.stalls = 0
+
+    def update(self, latency, queue_depth, pipeline_depth=0.0, stalls=0):
+        """ Adjust the rate from the latest congestion signals
+
+        :param float latency: the seconds the oldest payload has been waiting to be taken or acknowledged by the
+                              CogServer, or the recent time one takes
+        :param int queue_depth: the number of snippets waiting to be sent
+        :param float pipeline_depth: the share of the pipeline waiting to be acknowledged, from 0.0 to 1.0
+        :param int stalls: the number of sends so far that timed out waiting for room in the pipeline
+        :return: the new rate in Hz
+        """
+
+        stalled = stalls > self.stalls
+        self.stalls = stalls
+
+        if latency > self.target_latency or queue_depth > self.max_queue or \
+                pipeline_depth > self.max_pipeline_depth or stalled:
+            self.rate *= self.decrease
+        else:
+            self.rate += self.increase
+
+        self.rate = min(self.max_rate, max(self.min_rate, self.rate))
+        return self.rate
+
+    def period(self):
+        return 1.0 / self.rate
@@ -0,0 +1,149 @@
+#
+# recorder.py - Record the bridge's inbound messages and outbound scheme for replay.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import struct
+import threading
+import time
+from StringIO import StringIO
+from collections import namedtuple
+
+# A recording is an append-only file of records. Each record is a fixed
+# header followed by a payload:
+#
+#   kind     uint8    DEFINE, INBOUND or OUTBOUND
+#   channel  uint16   the channel the record belongs to
+#   stamp    float64  seconds since the epoch
+#   length   uint32   bytes in the payload
+#
+# DEFINE records name a channel and give the ROS message type it carries,
+# 'name\ttype'. INBOUND records hold a message received on a channel,
+# serialized the way ROS sends it over the wire. OUTBOUND records hold the
+# scheme sent to the CogServer, and their channel is the sender lane.
+#
+# Channels are defined again each time a recording is appended to, a
+# reader always uses the latest definition.
+
+MAGIC = "GBREC1\n"
+
+DEFINE = 0
+INBOUND = 1
+OUTBOUND = 2
+
+HEADER = struct.Struct("<BHdI")
+
+Record = namedtuple("Record", ["kind", "channel", "stamp", "msg_type", "payload"])
+
+
+class Recorder(object):
+    """
+        Appends the messages the bridge receives and the scheme it sends to a recording. Safe to call from any
+        thread.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: the recording, created if it doesn't exist and appended to if it does
+        """
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.channels = {}  # name -> channel number
+        self.records = 0
+
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "ab")
+        if new:
+            self.file.write(MAGIC)
+
+    def inbound(self, name, msg, stamp=None):
+        """ Record a message received by a callback
+
+        :param str name: the name of the channel, e.g. 'faces'
+        :param genpy.Message msg: the message
+        :param float stamp: when it was received, defaults to now
+        :return: None
+        """
+
+        buff = StringIO()
+        msg.serialize(buff)
+
+        with self.lock:
+            channel = self.channels.get(name)
+            if channel is None:
+                channel = self.channels[name] = len(self.channels)
+                self._write(DEFINE, channel, time.time(), "{}\t{}".format(name, msg._type))
+            self._write(INBOUND, channel, stamp, buff.getvalue())
+
+    def outbound(self, content, lane, stamp=None):
+        """ Record scheme sent to the CogServer
+
+        :param str content: newline terminated scheme expressions
+        :param int lane: the sender lane
+        :return: None
+        """
+
+        with self.lock:
+            self._write(OUTBOUND, lane, stamp, content)
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+    def _write(self, kind, channel, stamp, payload):
+        if self.file.closed:
+            return
+        if stamp is None:
+            stamp = time.time()
+        self.file.write(HEADER.pack(kind, channel, stamp, len(payload)))
+        self.file.write(payload)
+        self.records += 1
+
+
+def read_recording(path):
+    """ Read the records of a recording in order. A record cut short at the end of the file, e.g. by a crash, is
+    ignored.
+
+    :param str path: the recording
+    :return: generator of Record, with the channel name and message type filled in for INBOUND records
+    """
+
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError("{} is not a ghost_bridge recording".format(path))
+
+        channels = {}
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            kind, channel, stamp, length = HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+
+            if kind == DEFINE:
+                name, msg_type = payload.split("\t", 1)
+                channels[channel] = (name, msg_type)
+            elif kind == INBOUND:
+                name, msg_type = channels[channel]
+                yield Record(kind, name, stamp, msg_type, payload)
+            else:
+                yield Record(kind, channel, stamp, None, payload)
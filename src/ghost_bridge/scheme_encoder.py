@@ -0,0 +1,241 @@
+#
+# scheme_encoder.py - Encode perception and feedback commands as scheme expressions.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import math
+import threading
+
+# Each command the bridge sends is a call to a scheme procedure with string
+# and number arguments, e.g. (perceive-emotion "a4f3" "happy" 0.8). The
+# encoder compiles a template per command once, and then only has to
+# escape the strings and format the numbers of each call.
+#
+# Strings are escaped, so a quote or backslash in a sentence can't break
+# the expression. Numbers are written with a fixed number of decimal
+# places and trailing zeros removed, 0.8 rather than 0.800000011920929.
+
+STRING = "s"
+NUMBER = "f"
+FRAME = "F"
+
+# The arguments of each command, one type character per argument
+COMMANDS = {
+    "perceive-face": STRING + NUMBER,
+    "perceive-face-appeared": STRING,
+    "perceive-face-lost": STRING,
+    "perceive-emotion": STRING + STRING + NUMBER,
+    "perceive-dominant-emotion": STRING + STRING,
+    "perceive-eye-state": STRING + STRING + NUMBER,
+    "perceive-eye-event": STRING + STRING + NUMBER + NUMBER,
+    "perceive-face-talking": STRING + NUMBER,
+    "perceive-word": STRING + STRING,
+    "perceive-sentence-trace": NUMBER,
+    "perceive-neck-dir": STRING,
+    "perceive-frame": FRAME,
+    "ghost": STRING,
+    "say-started": "",
+    "say-finished": ""
+}
+
+
+def escape_string(value):
+    """ Quote a value as a scheme string literal
+
+    :param value: str or unicode, unicode is UTF-8 encoded
+    :return: str
+    """
+
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    elif not isinstance(value, str):
+        value = str(value)
+
+    if '\\' in value or '"' in value or '\n' in value or '\r' in value:
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+    return '"' + value + '"'
+
+
+class NumberFormatter(object):
+    """
+        Formats numbers with a fixed number of decimal places, without trailing zeros.
+    """
+
+    def __init__(self, precision=3):
+        """
+        :param int precision: the number of decimal places
+        """
+
+        self.precision = precision
+        self.format = "%.{}f".format(precision)
+
+    def __call__(self, value):
+        value = float(value)
+        if math.isnan(value):
+            return "+nan.0"
+        if math.isinf(value):
+            return "+inf.0" if value > 0 else "-inf.0"
+
+        text = self.format % value
+        if '.' in text:
+            text = text.rstrip('0').rstrip('.')
+        if text == "-0":
+            text = "0"
+        return text
+
+
+class FrameFormatter(object):
+    """
+        Formats a frame's worth of face perceptions as the quoted list perceive-frame takes, one entry per face:
+        (face-id confidence ((eye-id state) ...) ((emotion-id confidence) ...) dominant-emotion-id). The confidence
+        and dominant emotion are #f when they aren't being perceived.
+    """
+
+    def __init__(self, number_formatter):
+        self.number_formatter = number_formatter
+
+    def __call__(self, faces):
+        """
+        :param list faces: (face_id, confidence or None, [(eye_id, state)], [(emotion_id, confidence)],
+                           dominant emotion_id or None) for each face
+        :return: str
+        """
+
+        number = self.number_formatter
+        parts = ["'("]
+        for face_id, confidence, eyes, emotions, dominant in faces:
+            parts.append("(")
+            parts.append(escape_string(face_id))
+            parts.append(" #f (" if confidence is None else " " + number(confidence) + " (")
+            parts.append(" ".join("(" + escape_string(eye_id) + " " + number(state) + ")" for eye_id, state in eyes))
+            parts.append(") (")
+            parts.append(" ".join("(" + escape_string(emotion_id) + " " + number(value) + ")"
+                                  for emotion_id, value in emotions))
+            parts.append(") #f)" if dominant is None else ") " + escape_string(dominant) + ")")
+        parts.append(")")
+        return "".join(parts)
+
+
+class CommandTemplate(object):
+    """
+        The precompiled form of one command.
+    """
+
+    def __init__(self, name, arg_types, number_formatter):
+        self.name = name
+        self.arg_types = arg_types
+        self.prefix = bytearray("(" + name)
+        formatters = {STRING: escape_string, NUMBER: number_formatter, FRAME: FrameFormatter(number_formatter)}
+        self.encoders = [formatters[t] for t in arg_types]
+
+        # Commands without arguments are the same every time
+        self.constant = str(self.prefix) + ")\n" if not arg_types else None
+
+    def encode_into(self, buf, args):
+        if len(args) != len(self.encoders):
+            raise ValueError("{} takes {} arguments, {} given".format(self.name, len(self.encoders), len(args)))
+
+        if self.constant is not None:
+            buf.extend(self.constant)
+            return len(self.constant)
+
+        start = len(buf)
+        try:
+            buf.extend(self.prefix)
+            for encoder, arg in zip(self.encoders, args):
+                buf.extend(" ")
+                buf.extend(encoder(arg))
+            buf.extend(")\n")
+        except Exception:
+            # Don't leave half a command in the buffer
+            del buf[start:]
+            raise
+        return len(buf) - start
+
+
+class SchemeEncoder(object):
+    """
+        Encodes commands as newline terminated scheme expressions, either as a str or appended to a reusable
+        bytearray.
+
+        Example:
+            encoder = SchemeEncoder(precision=2)
+            encoder.encode("perceive-emotion", "a4f3", "happy", 0.8123)  # '(perceive-emotion "a4f3" "happy" 0.81)\\n'
+
+            buf = bytearray()
+            encoder.encode_into(buf, "perceive-face", "a4f3", 0.9)
+            encoder.encode_into(buf, "perceive-face-talking", "a4f3", 1.0)
+    """
+
+    def __init__(self, precision=3, commands=None):
+        """
+        :param int precision: the number of decimal places numbers are written with
+        :param dict commands: the argument types of each command, defaults to COMMANDS
+        """
+
+        self.number_formatter = NumberFormatter(precision)
+        self.templates = {}
+        for name, arg_types in (commands or COMMANDS).items():
+            self.register(name, arg_types)
+        self.local = threading.local()
+
+    def register(self, name, arg_types):
+        """ Add a command
+
+        :param str name: the name of the scheme procedure
+        :param str arg_types: one character per argument, STRING, NUMBER or FRAME
+        :return: None
+        """
+
+        self.templates[name] = CommandTemplate(name, arg_types, self.number_formatter)
+
+    def encode_into(self, buf, name, *args):
+        """ Append a command to a buffer
+
+        :param bytearray buf: the buffer
+        :param str name: the name of the command
+        :param args: the arguments of the command
+        :return: the number of bytes appended
+        """
+
+        template = self.templates.get(name)
+        if template is None:
+            raise ValueError("Unknown command: {}".format(name))
+        return template.encode_into(buf, args)
+
+    def encode(self, name, *args):
+        """ Encode a command
+
+        :param str name: the name of the command
+        :param args: the arguments of the command
+        :return: str
+        """
+
+        template = self.templates.get(name)
+        if template is None:
+            raise ValueError("Unknown command: {}".format(name))
+        if template.constant is not None:
+            return template.constant
+
+        # Each thread reuses its own scratch buffer
+        buf = getattr(self.local, "buf", None)
+        if buf is None:
+            buf = self.local.buf = bytearray()
+        template.encode_into(buf, args)
+        content = str(buf)
+        del buf[:]
+        return content
@@ -0,0 +1,277 @@
+#
+# sender.py - Asynchronous delivery of scheme snippets to the CogServer.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import threading
+import time
+from collections import deque
+
+# Overflow policies
+DROP_OLDEST = "drop_oldest"  # high rate streams (faces, eyes, emotions), only the latest values matter
+NEVER_DROP = "never_drop"  # conversational events (sentences, say-started/say-finished) must all arrive
+
+# Lanes, in the order they are drained
+CONVERSATION = 0
+TELEMETRY = 1
+
+
+# The ROS subscriber callbacks must not wait on the CogServer, so they
+# hand their snippets to an AsyncSender, which queues them and returns
+# straight away. A background thread takes snippets off the queues and
+# writes them to the CogServer.
+#
+# There is one queue (lane) for conversational traffic and one for face
+# telemetry. The conversation lane is always drained first, so a sentence
+# never waits behind a backlog of emotion updates.
+#
+# While the CogServer is unreachable the lanes buffer what is sent. Stale
+# telemetry expires, and the conversation lane is replayed in order once
+# the CogServer is back. Each lane is written as its own payload, and the
+# conversation's are kept by the session until the CogServer acknowledges
+# them, so the ones in flight when a session is lost are resent too.
+
+class Lane(object):
+    """
+        A queue of snippets with its own overflow policy and statistics.
+    """
+
+    def __init__(self, name, policy, maxsize=None, max_age=None, window=10.0):
+        """
+        :param str name: the name of the lane, used in the statistics
+        :param str policy: DROP_OLDEST or NEVER_DROP
+        :param int maxsize: the number of snippets queued before DROP_OLDEST starts dropping, None for unbounded
+        :param float max_age: seconds after which a queued snippet is too stale to send, None to keep it forever
+        :param float window: the number of seconds the send rate is averaged over
+        """
+
+        self.name = name
+        self.policy = policy
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.window = window
+
+        self.queue = deque()  # (time queued, content)
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.expired = 0
+        self.latencies = deque(maxlen=1000)  # seconds from queued to sent
+        self.sent_times = deque(maxlen=1000)
+
+    def put(self, content):
+        if self.policy == DROP_OLDEST and self.maxsize is not None and len(self.queue) >= self.maxsize:
+            self.queue.popleft()
+            self.dropped += 1
+
+        self.queue.append((time.time(), content))
+        self.enqueued += 1
+
+    def expire(self, now):
+        """ Drop the snippets that have been queued for longer than max_age """
+
+        if self.max_age is None:
+            return
+        while self.queue and now - self.queue[0][0] > self.max_age:
+            self.queue.popleft()
+            self.expired += 1
+
+    def take(self, n):
+        items = []
+        while self.queue and len(items) < n:
+            items.append(self.queue.popleft())
+        return items
+
+    def requeue(self, items):
+        """ Put items that failed to send back at the front of the lane, or drop them if the lane drops. """
+
+        if self.policy == NEVER_DROP:
+            self.queue.extendleft(reversed(items))
+        else:
+            self.dropped += len(items)
+
+    def mark_sent(self, items, now):
+        for queued, content in items:
+            self.latencies.append(now - queued)
+            self.sent_times.append(now)
+        self.sent += len(items)
+
+    def stats(self):
+        """ Statistics for the lane
+
+        :return: dict with the queue length, counters, send rate (snippets/s) and queueing latency (s)
+        """
+
+        now = time.time()
+        recent = sum(1 for t in self.sent_times if now - t <= self.window)
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "queued": len(self.queue),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "rate": recent / self.window,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else 0.0
+        }
+
+
+class AsyncSender(object):
+    """
+        Queues scheme snippets by lane and sends them to the CogServer from a background thread.
+    """
+
+    def __init__(self, connection, maxsize=256, max_payload=64, telemetry_max_age=2.0, conversation_max_age=60.0,
+                 metrics=None, recorder=None):
+        """
+        :param connection: the CogServerPool to send on
+        :param int maxsize: the number of telemetry snippets that can be queued before the oldest is dropped
+        :param int max_payload: the maximum number of queued snippets written to the CogServer in one go
+        :param float telemetry_max_age: seconds after which queued telemetry is too stale to send
+        :param float conversation_max_age: seconds after which queued conversation is too stale to replay
+        :param ghost_bridge.metrics.Metrics metrics: records write counts, bytes, errors and latencies if given
+        :param ghost_bridge.recorder.Recorder recorder: records everything sent if given
+        """
+
+        self.connection = connection
+        self.max_payload = max_payload
+        self.metrics = metrics
+        self.recorder = recorder
+
+        self.lanes = [
+            Lane("conversation", NEVER_DROP, max_age=conversation_max_age),
+            Lane("telemetry", DROP_OLDEST, maxsize, max_age=telemetry_max_age)
+        ]
+
+        self.cond = threading.Condition()
+        self.stopped = threading.Event()
+
+        # Moving average of the seconds each write to the CogServer takes
+        self.send_latency = 0.0
+
+        self.thread = threading.Thread(target=self.run, name="cogserver_sender")
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def dropped(self):
+        return sum(lane.dropped for lane in self.lanes)
+
+    def send(self, content, lane=TELEMETRY):
+        """ Queue content to be sent to the CogServer. Never blocks.
+
+        :param str content: newline terminated scheme expressions
+        :param int lane: CONVERSATION or TELEMETRY
+        :return: 0 (same as netcat)
+        """
+
+        if self.recorder is not None:
+            self.recorder.outbound(content, lane)
+
+        with self.cond:
+            self.lanes[lane].put(content)
+            self.cond.notify()
+        return 0
+
+    def qsize(self):
+        return sum(len(lane.queue) for lane in self.lanes)
+
+    def stats(self):
+        """ Statistics for each lane
+
+        :return: dict of lane name to lane statistics
+        """
+
+        with self.cond:
+            return dict((lane.name, lane.stats()) for lane in self.lanes)
+
+    def run(self):
+        while True:
+            # Don't spin while the CogServer's circuit breaker is open, snippets stay buffered in the lanes
+            delay = self.connection.retry_in()
+            if delay > 0:
+                self.stopped.wait(delay)
+
+            with self.cond:
+                while not self.stopped.is_set() and self.qsize() == 0:
+                    self.cond.wait()
+                if self.stopped.is_set():
+                    return
+
+                # Higher priority lanes go first, lower priority lanes fill what space is left
+                now = time.time()
+                taken = []
+                space = self.max_payload
+                for lane in self.lanes:
+                    lane.expire(now)
+                    items = lane.take(space)
+                    if items:
+                        taken.append((lane, items))
+                        space -= len(items)
+
+            if not taken:
+                continue
+
+            start = time.time()
+            result = 0
+            sent = []
+            for lane, items in taken:
+                content = ''.join(content for queued, content in items)
+                result = self.connection.send(content, keep=lane.policy == NEVER_DROP)
+                if result != 0:
+                    break
+                sent.append((lane, items, content))
+
+            with self.cond:
+                now = time.time()
+                if result == 0:
+                    self.send_latency = 0.8 * self.send_latency + 0.2 * (now - start)
+                for i, (lane, items) in enumerate(taken):
+                    if i < len(sent):
+                        lane.mark_sent(items, now)
+                    else:
+                        lane.requeue(items)
+
+            if self.metrics is not None:
+                self.record(sent, result, start, now)
+
+    def record(self, sent, result, start, now):
+        metrics = self.metrics
+        if result != 0:
+            metrics.increment("write_errors")
+
+        for lane, items, content in sent:
+            metrics.increment("writes")
+            metrics.increment("write_bytes", len(content))
+            for queued, item in items:
+                metrics.observe("queue_latency." + lane.name, now - queued)
+        if result == 0:
+            metrics.observe("write_latency", now - start)
+
+    def stop(self):
+        with self.cond:
+            self.stopped.set()
+            self.cond.notify_all()
+        self.thread.join(1.0)
@@ -0,0 +1,140 @@
+#
+# tracing.py - Per stage latency of the conversational and gaze loops.
+# Copyright (C) 2018  Hanson Robotics
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License v3 as
+# published by the Free Software Foundation and including the exceptions
+# at http://opencog.org/wiki/Licenses
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to:
+# Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import threading
+from collections import OrderedDict
+
+import rospy
+
+
+# A trace follows one input through the loop, e.g. a sentence from the
+# /speech topic, through Ghost, to the TTS message that answers it. Each
+# stage it passes is marked with a timestamp, and the time between two
+# consecutive stages is added to a latency histogram named
+# trace.<loop>.<stage>-><next stage>, so the slow stage stands out.
+#
+# Ghost doesn't carry ids through its rules, so the id of a sentence's
+# trace is stored in the atomspace next to it (perceive-sentence-trace in
+# perceptions.scm), and the action node reads it back into the GhostSay
+# message of the answer. Trace ids start at 1, so 0 can stand for none.
+# Only the latest sentence's id is kept there, so an answer to a sentence
+# that was followed by another before Ghost answered it closes the later
+# sentence's trace instead.
+
+class LatencyTracer(object):
+    """
+        Follows inputs through the stages of a loop and aggregates the time spent between stages.
+    """
+
+    def __init__(self, metrics, name, max_traces=64):
+        """
+        :param ghost_bridge.metrics.Metrics metrics: where the stage latencies are recorded
+        :param str name: the name of the loop, e.g. 'speech'
+        :param int max_traces: the number of open traces kept, the oldest is abandoned after that
+        """
+
+        self.metrics = metrics
+        self.name = name
+        self.max_traces = max_traces
+
+        self.traces = OrderedDict()  # trace_id -> (start stamp, last stage, last stamp)
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def start(self, stage, stamp=None):
+        """ Start a trace
+
+        :param str stage: the name of the first stage
+        :param float stamp: when the stage happened in seconds, defaults to now
+        :return: the trace id
+        """
+
+        if stamp is None:
+            stamp = rospy.get_time()
+
+        with self.lock:
+            trace_id = self.next_id
+            self.next_id += 1
+            self.traces[trace_id] = (stamp, stage, stamp)
+            while len(self.traces) > self.max_traces:
+                self.traces.popitem(last=False)
+                self.metrics.increment("trace.{}.abandoned".format(self.name))
+        return trace_id
+
+    def mark(self, trace_id, stage, stamp=None):
+        """ Mark that a trace reached a stage
+
+        :param int trace_id: the trace id returned by start(), ignored if None or no longer open
+        :param str stage: the name of the stage
+        :param float stamp: when the stage happened in seconds, defaults to now
+        :return: None
+        """
+
+        if stamp is None:
+            stamp = rospy.get_time()
+
+        with self.lock:
+            trace = self.traces.get(trace_id)
+            if trace is None:
+                return
+            start, last_stage, last_stamp = trace
+            self.traces[trace_id] = (start, stage, stamp)
+
+        self.metrics.observe("trace.{}.{}->{}".format(self.name, last_stage, stage), max(0.0, stamp - last_stamp))
+
+    def finish(self, trace_id, stage, stamp=None):
+        """ Mark the last stage of a trace and record its total latency
+
+        :param int trace_id: the trace id returned by start(), ignored if None or no longer open
+        :param str stage: the name of the last stage
+        :param float stamp: when the stage happened in seconds, defaults to now
+        :return: None
+        """
+
+        if stamp is None:
+            stamp = rospy.get_time()
+
+        self.mark(trace_id, stage, stamp)
+        with self.lock:
+            trace = self.traces.pop(trace_id, None)
+        if trace is not None:
+            self.metrics.observe("trace.{}.total".format(self.name), max(0.0, stamp - trace[0]))
+
+    def discard(self, trace_id):
+        """ Abandon a trace without recording its total, e.g. when its input was dropped
+
+        :param int trace_id: the trace id returned by start()
+        :return: None
+        """
+
+        with self.lock:
+            self.traces.pop(trace_id, None)
+
+    def report(self):
+        """ A table of the latency of each stage
+
+        :return: str
+        """
+
+        prefix = "trace.{}.".format(self.name)
+        lines = ["{:<42} {:>7} {:>8} {:>8} {:>8}".format(self.name + " latency (s)", "count", "p50", "p95", "p99")]
+        for name, summary in sorted(self.metrics.summaries(prefix).items()):
+            lines.append("  {:<40} {:>7} {:>8.3f} {:>8.3f} {:>8.3f}".format(
+                name[len(prefix):], summary["count"], summary["p50"], summary["p95"], summary["p99"]))
+        return "\n".join(lines)